@@ -0,0 +1,120 @@
+"""
+Retry-storm benchmark: how fast the outbox consumer can push failed
+messages into the retry queues.
+
+Runs against an in-memory RabbitMQ stand-in where every broker round-trip
+(exchange declare, publish confirm) costs `--rtt-ms`. Compares the old
+behaviour (declare the DLX exchange for every failed message) with
+`_republish_retry` (exchange handle cached per dedicated retry channel).
+
+    python debug/retry_storm.py --messages 2000 --concurrency 32 --rtt-ms 2
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.append(str(PROJECT_ROOT))
+
+from src.outbox.backoff import delay_bucket, retry_delay
+from src.outbox.infra import EXCHANGE_DLX, rkey_delay
+from src.outbox.producer import build_message
+from src.outbox.worker import _republish_retry
+
+
+class StandInExchange:
+    def __init__(self, broker: "StandInBroker", name: str) -> None:
+        self._broker = broker
+        self.name = name
+
+    async def publish(self, message, routing_key: str) -> None:
+        await self._broker.round_trip()
+        self._broker.published += 1
+
+
+class StandInChannel:
+    def __init__(self, broker: "StandInBroker") -> None:
+        self._broker = broker
+
+    async def declare_exchange(self, name: str, *args, **kwargs) -> StandInExchange:
+        await self._broker.round_trip()
+        self._broker.declares += 1
+        return StandInExchange(self._broker, name)
+
+    async def get_exchange(self, name: str, ensure: bool = True) -> StandInExchange:
+        if ensure:
+            await self._broker.round_trip()
+            self._broker.declares += 1
+        return StandInExchange(self._broker, name)
+
+
+class StandInBroker:
+    def __init__(self, rtt: float) -> None:
+        self.rtt = rtt
+        self.published = 0
+        self.declares = 0
+
+    async def round_trip(self) -> None:
+        await asyncio.sleep(self.rtt)
+
+
+async def _legacy_republish_retry(ch: StandInChannel, payload: dict) -> None:
+    delay = retry_delay(int(payload.get("retry_count", 0)), payload["url"])
+    dlx = await ch.declare_exchange(EXCHANGE_DLX, durable=True)
+    await dlx.publish(
+        build_message(payload, expiration=delay),
+        routing_key=rkey_delay(delay_bucket(delay)),
+    )
+
+
+async def _storm(republish, messages: int, concurrency: int, rtt: float) -> dict:
+    broker = StandInBroker(rtt)
+    channel = StandInChannel(broker)
+    semaphore = asyncio.Semaphore(concurrency)
+    payload = {
+        "kind": "json",
+        "method": "POST",
+        "url": "http://crm.local/api",
+        "headers": {},
+        "json": {"message": "x" * 512},
+        "retry_count": 1,
+    }
+
+    async def _one() -> None:
+        async with semaphore:
+            await republish(channel, dict(payload))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_one() for _ in range(messages)))
+    elapsed = time.perf_counter() - started
+    return {
+        "seconds": round(elapsed, 3),
+        "msgs_per_sec": round(broker.published / elapsed, 1),
+        "declares": broker.declares,
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    args = parser.parse_args()
+    rtt = args.rtt_ms / 1000
+
+    legacy = await _storm(_legacy_republish_retry, args.messages, args.concurrency, rtt)
+    cached = await _storm(_republish_retry, args.messages, args.concurrency, rtt)
+    print(f"declare per message: {legacy}")
+    print(f"cached exchange:     {cached}")
+    print(f"speedup: x{legacy['seconds'] / cached['seconds']:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
@@ -1,11 +1,16 @@
 import asyncio
 
 from src.email_worker.check_email import check_mail
+from src.metrics import monitor_loop_lag, report_metrics
+from src.outbox.producer import outbox_publisher
 from src.outbox.worker import main as queue_worker_main
 from src.poll import poll_mail
+from src.processors.executor import processor_pool
+from src.query_worker.http_session import http_sessions
 from src.rules.apointment_rules import rules as appointment_rules
 from src.rules.insurance_rules import rules as insurance_rules
 from src.settings import appointment_mail_settings, insurance_mail_settings
+from src.storage.event_registry import event_registry
 
 RETRY_DELAY = 30
 
@@ -23,6 +28,8 @@ async def run_task(name, func, **kwargs):
 
 async def main():
     print("Запуск всех процессов...")
+    # Connects in the background and drains messages spilled by a previous run.
+    outbox_publisher.start()
 
     work_poller_task = asyncio.create_task(
         run_task(
@@ -47,13 +54,30 @@ async def main():
     )
 
     queue_task = asyncio.create_task(run_task("queue_worker", queue_worker_main))
-
-    await asyncio.gather(
-        work_poller_task,
-        support_poller_task,
-        queue_task,
+    metrics_task = asyncio.create_task(run_task("metrics", report_metrics))
+    loop_lag_task = asyncio.create_task(run_task("loop_lag", monitor_loop_lag))
+    cleanup_task = asyncio.create_task(
+        run_task("event_cleanup", event_registry.cleanup_loop)
+    )
+    expiry_task = asyncio.create_task(
+        run_task("event_expiry", event_registry.listen_expirations)
     )
 
+    try:
+        await asyncio.gather(
+            work_poller_task,
+            support_poller_task,
+            queue_task,
+            metrics_task,
+            loop_lag_task,
+            cleanup_task,
+            expiry_task,
+        )
+    finally:
+        processor_pool.shutdown()
+        await http_sessions.close()
+        await outbox_publisher.close()
+
 
 if __name__ == "__main__":
     try:
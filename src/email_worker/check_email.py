@@ -1,13 +1,19 @@
+import asyncio
+import imaplib
 from uuid import uuid4
 
 from aiohttp import FormData
-from src.email_worker.lib.mail_client import MailClient
 from src.email_worker.lib.mail_parser import EmailParser
+from src.email_worker.lib.mail_session import CONNECTION_ERRORS, MailSession
 from src.email_worker.schema import MailCheckSettings
-from src.outbox.producer import enqueue_json_request
+from src.metrics import metrics
+from src.outbox.producer import enqueue_form_request, enqueue_json_request
+from src.processors.executor import processor_pool
 from src.query_worker.request_sender import send_request
 from src.query_worker.schema import QueryRules
+from src.settings import RABBIT_URL
 from src.storage.event_registry import event_registry
+from src.storage.mail_checkpoint import mail_checkpoints
 
 
 def _rule_key(rule) -> str:
@@ -24,9 +30,22 @@ async def apply_rule_action(
     email_subject: str,
     email_sender: str,
     attachments: list[tuple[str, bytes]] | None = None,
+    confirms: list[asyncio.Task] | None = None,
 ):
+    """
+    Runs the rule processor and sends/enqueues the result.
+    If `confirms` is given, outbox publishes do not wait for the broker:
+    their confirm tasks are appended to `confirms` for the caller to await.
+    Without RABBIT_URL every result is sent synchronously.
+    """
     processed_body = (
-        rule.action.processor(email_body, email_subject, email_sender, attachments)
+        await processor_pool.run(
+            rule.action.processor,
+            email_body,
+            email_subject,
+            email_sender,
+            attachments,
+        )
         if rule.action.processor
         else email_body
     )
@@ -35,21 +54,44 @@ async def apply_rule_action(
     try:
         print(f"Подготовка запроса {rule.action.type} к {url}...")
 
-        if isinstance(processed_body, dict):
-            await enqueue_json_request(
+        if isinstance(processed_body, dict) and RABBIT_URL:
+            confirm = await enqueue_json_request(
                 method=rule.action.type,
                 url=url,
                 headers=rule.action.headers,
                 json_body=processed_body,
+                wait=confirms is None,
             )
+            if confirm is not None:
+                confirms.append(confirm)
             print("Задание (JSON) поставлено в очередь.")
             return (True, url, None)
 
-        if (
+        form_chunks = None
+        if isinstance(processed_body, FormData):
+            form_chunks = [processed_body]
+        elif (
             isinstance(processed_body, list)
             and processed_body
             and all(isinstance(item, FormData) for item in processed_body)
         ):
+            form_chunks = processed_body
+
+        if form_chunks and RABBIT_URL:
+            for index, chunk in enumerate(form_chunks, start=1):
+                confirm = await enqueue_form_request(
+                    method=rule.action.type,
+                    url=url,
+                    headers=rule.action.headers,
+                    form_data=chunk,
+                    wait=confirms is None,
+                )
+                if confirm is not None:
+                    confirms.append(confirm)
+            print(f"Задание (multipart, {len(form_chunks)} шт.) поставлено в очередь.")
+            return (True, url, None)
+
+        if isinstance(processed_body, list) and form_chunks:
             for index, chunk in enumerate(processed_body, start=1):
                 print(f"Отправка пациентов chunk {index}/{len(processed_body)} на {url}...")
                 response = await send_request(
@@ -76,102 +118,255 @@ async def apply_rule_action(
         return (False, url, e)
 
 
-async def check_mail(settings: MailCheckSettings, rules: QueryRules):
-    client = MailClient(settings)
-    await event_registry.cleanup_expired()
+def _mailbox_key(settings: MailCheckSettings) -> str:
+    return f"{settings.username}@{settings.imap_server}"
+
+
+async def _load_sync_state(client, settings: MailCheckSettings) -> dict:
+    """
+    Loads the (UIDVALIDITY, last_uid) checkpoint of the mailbox.
+    Without a checkpoint, or when UIDVALIDITY changed (mailbox recreated, UIDs
+    reassigned), resyncs: current UNSEEN letters become the retry list and the
+    high-water mark jumps to the highest existing UID.
+    """
+    mailbox = _mailbox_key(settings)
+    state = await mail_checkpoints.load(mailbox)
+    if state is not None and state.get("uidvalidity") == client.uidvalidity:
+        return state
+
+    if state is not None:
+        print(
+            f"[IMAP] UIDVALIDITY {mailbox} изменился "
+            f"({state.get('uidvalidity')} -> {client.uidvalidity}). Ресинхронизация."
+        )
+        metrics.inc(f"imap.uidvalidity_resyncs[{settings.username}]")
+    return {
+        "uidvalidity": client.uidvalidity,
+        "last_uid": await client.highest_uid(),
+        "retry_uids": await client.search_unseen(),
+    }
+
+
+def _match_rule(rules: QueryRules, subject: str, sender: str):
+    for rule in rules.root:
+        subject_match = (
+            rule.rule.subject.lower() in subject.lower() if rule.rule.subject else True
+        )
+        sender_match = (
+            (
+                rule.rule.sender.lower() in sender.lower()
+                if rule.rule.sender.lower().startswith("@")
+                else sender.lower() == rule.rule.sender.lower()
+            )
+            if rule.rule.sender
+            else True
+        )
+        if subject_match and sender_match:
+            return rule
+    return None
+
+
+def _decode_headers(msg) -> tuple[str, str]:
+    subject = EmailParser.decode_subject(msg.get("Subject"))
+    sender_raw = msg.get("From")
+    sender = (
+        EmailParser.decode_sender(sender_raw)
+        if sender_raw
+        else "Неизвестный отправитель"
+    )
+    return subject, sender
+
+
+async def _process_message(rule, mail_id: int, msg, subject: str, sender: str):
+    """
+    Runs the action of `rule` for a downloaded letter.
+    Returns None on failure, otherwise (event_id, confirms) where
+    `confirms` are outbox publishes still waiting for the broker.
+    """
+    body = EmailParser.get_body(msg)
+
+    rule_key = _rule_key(rule)
+    mail_identifier = str(mail_id)
+    event_id = f"{mail_identifier}-{uuid4().hex[:8]}"
+    await event_registry.start_event(
+        rule_key,
+        event_id,
+        permanent_file=rule.permanent_file,
+        metadata={
+            "mail_id": mail_identifier,
+            "sender": sender,
+            "subject": subject,
+        },
+    )
+
+    attachments = None
+    if rule.attachment_field:
+        attachments = EmailParser.get_attachments(msg)
+        if attachments:
+            await event_registry.store_attachments(event_id, attachments)
+
+    confirms: list[asyncio.Task] = []
+    success, url, error = await apply_rule_action(
+        rule, body, subject, sender, attachments, confirms=confirms
+    )
+    if success:
+        return event_id, confirms
+
+    print(
+        f"  [{mail_identifier}] [ОШИБКА] Действие для URL {url} не выполнено: {error}"
+    )
+    print(
+        f"  [{mail_identifier}] Письмо не будет отмечено как прочитанное из-за ошибки."
+    )
+    return None
+
+
+async def _process_batch(
+    settings: MailCheckSettings, batch: list, messages: dict
+) -> list[int]:
+    """
+    Processes downloaded letters concurrently, at most `settings.concurrency`
+    at a time. With `preserve_sender_order` letters from the same sender are
+    handled one after another in UID order.
+
+    Outbox publishes of the whole batch are pipelined; a letter counts as
+    processed only after all its broker confirms landed.
+    Returns UIDs processed successfully.
+    """
+    semaphore = asyncio.Semaphore(max(1, settings.concurrency))
+    groups: dict[object, list] = {}
+    rules_by_id = {}
+    for item in batch:
+        mail_id, rule, _parts, _subject, sender = item
+        rules_by_id[mail_id] = rule
+        key = sender.lower() if settings.preserve_sender_order else mail_id
+        groups.setdefault(key, []).append(item)
+
+    async def _process_group(items: list) -> list:
+        pending = []
+        for mail_id, rule, _parts, subject, sender in items:
+            msg = messages.get(mail_id)
+            if msg is None:
+                continue
+            async with semaphore:
+                try:
+                    result = await _process_message(rule, mail_id, msg, subject, sender)
+                except Exception as e:
+                    print(f"  [{mail_id}] [ОШИБКА] Не удалось обработать письмо: {e}")
+                    result = None
+            if result is not None:
+                pending.append((mail_id, *result))
+        return pending
+
+    results = await asyncio.gather(
+        *(_process_group(items) for items in groups.values())
+    )
+
+    processed = []
+    for mail_id, event_id, confirms in (p for group in results for p in group):
+        if confirms:
+            outcomes = await asyncio.gather(*confirms, return_exceptions=True)
+            errors = [o for o in outcomes if isinstance(o, BaseException)]
+            if errors:
+                print(
+                    f"  [{mail_id}] [ОШИБКА] Брокер не подтвердил публикацию: "
+                    f"{errors[0]}"
+                )
+                continue
+        print(f"  [{mail_id}] Действие выполнено успешно.")
+        await event_registry.finish_event(event_id, rules_by_id[mail_id].permanent_file)
+        processed.append(mail_id)
+    return processed
+
+
+async def check_mail(
+    settings: MailCheckSettings,
+    rules: QueryRules,
+    session: MailSession | None = None,
+):
+    own_session = session is None
+    if own_session:
+        session = MailSession(settings)
+    state = None
+    mail_ids: list[int] = []
+    completed: set[int] = set()
     try:
-        client.connect()
-        mail_ids = client.search_unseen()
+        client = await session.ensure()
+        state = await _load_sync_state(client, settings)
+        new_uids = await client.search_since_uid(state["last_uid"])
+        mail_ids = sorted(set(state["retry_uids"]) | set(new_uids))
         if mail_ids:
             print(f"Найдено {len(mail_ids)} новых писем.")
 
+        # Phase 1: only the headers needed for rule matching.
+        headers = await client.fetch_headers(mail_ids) if mail_ids else {}
+
+        matched = []
         for mail_id in mail_ids:
-            msg = client.fetch_email(mail_id)
-            subject = EmailParser.decode_subject(msg.get("Subject"))
-            sender_raw = msg.get("From")
-            sender = (
-                EmailParser.decode_sender(sender_raw)
-                if sender_raw
-                else "Неизвестный отправитель"
-            )
+            if mail_id not in headers:
+                completed.add(mail_id)
+                continue
+            header_msg, parts = headers[mail_id]
+            subject, sender = _decode_headers(header_msg)
             print("\nНовая почта:")
             print("  Тема:", subject)
             print("  Отправитель:", sender)
-            body = EmailParser.get_body(msg)
 
-            rule_found_and_processed = False
+            rule = _match_rule(rules, subject, sender)
+            if rule is None:
+                print(f"  Письмо от {sender} не соответствует ни одному из правил.")
+                metrics.inc(f"imap.unmatched_skipped[{settings.username}]")
+                completed.add(mail_id)
+                continue
+            print(f"  Найдено соответствие правилу (URL: {rule.action.url}).")
+            matched.append((mail_id, rule, parts, subject, sender))
 
-            for rule in rules.root:
-                subject_match = (
-                    rule.rule.subject.lower() in subject.lower()
-                    if rule.rule.subject
-                    else True
-                )
-                sender_match = (
-                    (
-                        rule.rule.sender.lower() in sender.lower()
-                        if rule.rule.sender.lower().startswith("@")
-                        else sender.lower() == rule.rule.sender.lower()
-                    )
-                    if rule.rule.sender
-                    else True
-                )
+        # Phase 2: body (and attachments if the rule needs them) for matched mail,
+        # downloaded and flagged \Seen in batches.
+        batch_size = max(1, settings.fetch_batch_size)
+        for start in range(0, len(matched), batch_size):
+            batch = matched[start : start + batch_size]
+            messages = await client.fetch_emails(
+                [
+                    (mail_id, parts, bool(rule.attachment_field))
+                    for mail_id, rule, parts, _subject, _sender in batch
+                ]
+            )
+            completed.update(
+                mail_id for mail_id, *_ in batch if mail_id not in messages
+            )
+            processed = await _process_batch(settings, batch, messages)
 
-                if subject_match and sender_match:
-                    print(
-                        f"  Найдено соответствие правилу (URL: {rule.action.url}). Выполняем..."
-                    )
-
-                    rule_key = _rule_key(rule)
-                    mail_identifier = (
-                        mail_id.decode() if isinstance(mail_id, bytes) else str(mail_id)
-                    )
-                    event_id = f"{mail_identifier}-{uuid4().hex[:8]}"
-                    await event_registry.start_event(
-                        rule_key,
-                        event_id,
-                        permanent_file=rule.permanent_file,
-                        metadata={
-                            "mail_id": mail_identifier,
-                            "sender": sender,
-                            "subject": subject,
-                        },
-                    )
-
-                    attachments = None
-                    if rule.attachment_field:
-                        attachments = EmailParser.get_attachments(msg)
-                        if attachments:
-                            await event_registry.store_attachments(
-                                rule_key, event_id, attachments
-                            )
-
-                    success, url, error = await apply_rule_action(
-                        rule, body, subject, sender, attachments
-                    )
-                    if success:
-                        print("  Действие выполнено успешно. Помечаем как прочитанное.")
-                        client.mark_as_seen(mail_id)
-                        await event_registry.finish_event(
-                            rule_key, event_id, rule.permanent_file
-                        )
-                    else:
-                        print(
-                            f"  [ОШИБКА] Действие для URL {url} не выполнено: {error}"
-                        )
-                        print(
-                            "  Письмо не будет отмечено как прочитанное из-за ошибки."
-                        )
-
-                    rule_found_and_processed = True
-                    break
-
-            if not rule_found_and_processed:
-                print(f"  Письмо от {sender} не соответствует ни одному из правил.")
+            if processed:
+                completed.update(processed)
+                print(f"  Помечаем как прочитанные: {len(processed)} писем.")
+                await client.mark_as_seen(processed)
+
+        session.touch()
 
+    except CONNECTION_ERRORS as e:
+        print(f"[IMAP] Соединение с {settings.username} разорвано: {e}")
+        await session.invalidate()
+    except imaplib.IMAP4.error as e:
+        # E.g. LOGIN rejected or throttled: start over with a fresh connection.
+        print(f"[IMAP] Ошибка IMAP для {settings.username}: {e}")
+        await session.invalidate()
     except Exception as e:
         print(
             f"[КРИТИЧЕСКАЯ ОШИБКА] Произошла непредвиденная ошибка в работе сервиса: {e}"
         )
     finally:
-        client.logout()
+        if state is not None:
+            # Everything not completed (action failed, cycle interrupted) is retried.
+            await mail_checkpoints.save(
+                _mailbox_key(settings),
+                state["uidvalidity"],
+                max([state["last_uid"], *mail_ids]),
+                [
+                    uid
+                    for uid in {*state["retry_uids"], *mail_ids}
+                    if uid not in completed
+                ],
+            )
+        if own_session:
+            await session.close()
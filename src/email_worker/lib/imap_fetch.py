@@ -0,0 +1,236 @@
+import re
+from dataclasses import dataclass, field
+from typing import Any
+
+_LITERAL_RE = re.compile(rb"\{(\d+)\}$")
+
+_OPEN = object()
+_CLOSE = object()
+
+
+def _tokenize(data: bytes, tokens: list) -> None:
+    i = 0
+    size = len(data)
+    while i < size:
+        ch = data[i : i + 1]
+        if ch in (b" ", b"\r", b"\n"):
+            i += 1
+        elif ch == b"(":
+            tokens.append(_OPEN)
+            i += 1
+        elif ch == b")":
+            tokens.append(_CLOSE)
+            i += 1
+        elif ch == b'"':
+            i += 1
+            chunk = bytearray()
+            while i < size and data[i : i + 1] != b'"':
+                if data[i : i + 1] == b"\\":
+                    i += 1
+                chunk += data[i : i + 1]
+                i += 1
+            i += 1
+            tokens.append(bytes(chunk).decode("utf-8", errors="replace"))
+        elif ch == b"{" and _LITERAL_RE.match(data[i:].rstrip()):
+            # The literal itself follows as a separate element of the response.
+            return
+        else:
+            start = i
+            depth = 0
+            while i < size:
+                c = data[i : i + 1]
+                if c == b"[":
+                    depth += 1
+                elif c == b"]":
+                    depth -= 1
+                elif depth == 0 and c in (b" ", b"(", b")"):
+                    break
+                i += 1
+            atom = data[start:i].decode("utf-8", errors="replace")
+            tokens.append(None if atom.upper() == "NIL" else atom)
+
+
+def _build(tokens: list) -> list:
+    stack: list[list] = [[]]
+    for token in tokens:
+        if token is _OPEN:
+            stack.append([])
+        elif token is _CLOSE:
+            if len(stack) > 1:
+                done = stack.pop()
+                stack[-1].append(done)
+        else:
+            stack[-1].append(token)
+    while len(stack) > 1:
+        done = stack.pop()
+        stack[-1].append(done)
+    return stack[0]
+
+
+def parse_fetch_response(msg_data) -> dict[int, dict[str, Any]]:
+    """
+    Parses imaplib `UID FETCH` data into UID -> {ITEM: value}.
+
+    Literals ({n} + bytes) are returned as bytes, quoted strings as str,
+    NIL as None, parenthesized lists as lists. Item names are upper-cased,
+    e.g. "BODYSTRUCTURE", "BODY[1.MIME]", "BODY[HEADER]".
+    Unsolicited FETCH responses without a UID are ignored.
+    """
+    tokens: list = []
+    for item in msg_data or []:
+        if isinstance(item, tuple):
+            _tokenize(item[0], tokens)
+            tokens.append(item[1])
+        elif isinstance(item, bytes):
+            _tokenize(item, tokens)
+
+    result: dict[int, dict[str, Any]] = {}
+    for node in _build(tokens):
+        if not isinstance(node, list):
+            continue
+        items: dict[str, Any] = {}
+        for index in range(0, len(node) - 1, 2):
+            key = node[index]
+            if isinstance(key, str):
+                items[key.upper()] = node[index + 1]
+        uid = items.get("UID")
+        if uid is None:
+            continue
+        result[int(uid)] = items
+    return result
+
+
+@dataclass
+class BodyPart:
+    section: str
+    content_type: str
+    params: dict[str, str] = field(default_factory=dict)
+    encoding: str = "7bit"
+    size: int = 0
+    disposition: str | None = None
+    filename: str | None = None
+
+    @property
+    def is_attachment(self) -> bool:
+        return self.disposition is not None
+
+    @property
+    def estimated_decoded_size(self) -> int:
+        """`size` is the encoded size; base64 inflates data by 4/3."""
+        if self.encoding.lower() == "base64":
+            return self.size * 3 // 4
+        return self.size
+
+
+def _as_str(value: Any) -> str:
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value or ""
+
+
+def _params(value: Any) -> dict[str, str]:
+    if not isinstance(value, list):
+        return {}
+    return {
+        _as_str(value[i]).lower(): _as_str(value[i + 1])
+        for i in range(0, len(value) - 1, 2)
+    }
+
+
+def _leaf(node: list, section: str) -> BodyPart:
+    maintype = _as_str(node[0]).lower()
+    subtype = _as_str(node[1]).lower()
+    params = _params(node[2])
+    try:
+        size = int(node[6])
+    except (IndexError, TypeError, ValueError):
+        size = 0
+
+    # Extension data (md5, disposition, ...) starts after the basic fields,
+    # which are longer for text/* (lines) and message/rfc822 (envelope, body, lines).
+    if maintype == "text":
+        ext_start = 8
+    elif maintype == "message" and subtype == "rfc822":
+        ext_start = 10
+    else:
+        ext_start = 7
+    disposition = None
+    disposition_params: dict[str, str] = {}
+    if len(node) > ext_start + 1 and isinstance(node[ext_start + 1], list):
+        disposition_node = node[ext_start + 1]
+        disposition = _as_str(disposition_node[0]).lower() or None
+        if len(disposition_node) > 1:
+            disposition_params = _params(disposition_node[1])
+
+    filename = (
+        disposition_params.get("filename")
+        or disposition_params.get("filename*")
+        or params.get("name")
+    )
+    return BodyPart(
+        section=section,
+        content_type=f"{maintype}/{subtype}",
+        params=params,
+        encoding=_as_str(node[5]) or "7bit",
+        size=size,
+        disposition=disposition,
+        filename=filename,
+    )
+
+
+def _walk(node: list, prefix: str, parts: list[BodyPart]) -> None:
+    index = 0
+    for child in node:
+        if not isinstance(child, list):
+            break
+        index += 1
+        section = f"{prefix}{index}"
+        if child and isinstance(child[0], list):
+            _walk(child, f"{section}.", parts)
+        else:
+            parts.append(_leaf(child, section))
+
+
+def parse_bodystructure(node: list) -> list[BodyPart] | None:
+    """
+    Flattens a BODYSTRUCTURE into its leaf parts with IMAP section numbers.
+    Returns None when the message has to be fetched whole:
+    - single-part messages (they have no addressable sub-parts);
+    - messages with an attached message/rfc822 (forwarded letter), whose
+      inner body and attachments EmailParser reads by walking into it.
+    """
+    if not isinstance(node, list) or not node or not isinstance(node[0], list):
+        return None
+    parts: list[BodyPart] = []
+    _walk(node, "", parts)
+    if any(part.content_type == "message/rfc822" for part in parts):
+        return None
+    return parts
+
+
+def select_parts(
+    parts: list[BodyPart], with_attachments: bool, max_attachment_bytes: int
+) -> tuple[list[BodyPart], int]:
+    """
+    Chooses the parts EmailParser will actually use:
+    - inline text/plain and text/html bodies;
+    - named attachments when `with_attachments`, unless their declared size
+      already exceeds `max_attachment_bytes`.
+    Returns the parts to download and the declared bytes that are skipped.
+    """
+    needed: list[BodyPart] = []
+    skipped_bytes = 0
+    for part in parts:
+        if not part.is_attachment:
+            wanted = part.content_type in ("text/plain", "text/html")
+        else:
+            wanted = (
+                with_attachments
+                and bool(part.filename)
+                and part.estimated_decoded_size <= max_attachment_bytes
+            )
+        if wanted:
+            needed.append(part)
+        else:
+            skipped_bytes += part.size
+    return needed, skipped_bytes
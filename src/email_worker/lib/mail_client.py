@@ -1,7 +1,78 @@
+import asyncio
 import email
 import imaplib
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from functools import partial
 
+from src.email_worker.lib.imap_fetch import (
+    parse_bodystructure,
+    parse_fetch_response,
+    select_parts,
+)
+from src.email_worker.lib.mail_parser import EmailParser
 from src.email_worker.schema import MailCheckSettings
+from src.metrics import metrics
+
+
+HEADER_FIELDS = "FROM SUBJECT MESSAGE-ID"
+
+
+def _parse_uids(messages) -> list[int]:
+    if not messages or not messages[0]:
+        return []
+    return [int(uid) for uid in messages[0].split()]
+
+
+def uid_set(uids: list[int]) -> str:
+    """Compact IMAP sequence set: [1, 2, 3, 7, 9, 10] -> "1:3,7,9:10"."""
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(
+        str(start) if start == end else f"{start}:{end}" for start, end in ranges
+    )
+
+
+def _check_fetch(status: str, msg_data) -> None:
+    """
+    A failed FETCH must not look like an empty one: callers treat UIDs
+    missing from a successful response as deleted and drop them for good.
+    """
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"UID FETCH failed: {status} {msg_data!r}")
+
+
+def _as_bytes(value) -> bytes:
+    if value is None:
+        return b""
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return value
+
+
+def _assemble(items: dict, needed) -> tuple:
+    """Rebuilds a message from FETCH items; returns (message, transferred bytes)."""
+    if needed is None:
+        raw_email = _as_bytes(items.get("BODY[]"))
+        return email.message_from_bytes(raw_email), len(raw_email)
+
+    msg = email.message_from_bytes(_as_bytes(items.get("BODY[HEADER]")))
+    payload = []
+    size = 0
+    for part in needed:
+        raw_part = _as_bytes(items.get(f"BODY[{part.section}.MIME]")) + _as_bytes(
+            items.get(f"BODY[{part.section}]")
+        )
+        size += len(raw_part)
+        payload.append(email.message_from_bytes(raw_part))
+    msg.set_payload(payload)
+    return msg, size
 
 
 class MailClient:
@@ -10,29 +81,339 @@ class MailClient:
     def __init__(self, settings: MailCheckSettings):
         self.settings = settings
         self.connection = None
+        self.capabilities: set[str] = set()
+        self.uidvalidity: int | None = None
+        self._idling = False
+        self._interrupted = False
+
+    @property
+    def is_connected(self) -> bool:
+        return self.connection is not None
 
     def connect(self):
-        self.connection = imaplib.IMAP4_SSL(
-            self.settings.imap_server, self.settings.imap_port
+        """
+        Opens, authenticates and selects INBOX. `connection` is set only once
+        all of that succeeded: a half-open session (e.g. LOGIN throttled) must
+        not look connected, or the next cycles would run in NONAUTH state.
+        """
+        connection = imaplib.IMAP4_SSL(
+            self.settings.imap_server,
+            self.settings.imap_port,
+            timeout=self.settings.timeout,
         )
-        self.connection.login(self.settings.username, self.settings.password)
-        self.connection.select("inbox")
+        try:
+            connection.login(self.settings.username, self.settings.password)
+            # Some servers advertise IDLE etc. only after LOGIN.
+            status, data = connection.capability()
+            if status == "OK" and data and data[0]:
+                capabilities = {c.upper() for c in data[0].decode().split()}
+            else:
+                capabilities = set(connection.capabilities)
+            status, data = connection.select("inbox")
+            if status != "OK":
+                raise imaplib.IMAP4.error(f"SELECT inbox failed: {data!r}")
+            _, uidvalidity = connection.response("UIDVALIDITY")
+            # The EXISTS count of SELECT is not new mail (see `idle`).
+            connection.untagged_responses.pop("EXISTS", None)
+        except BaseException:
+            with suppress(Exception):
+                connection.shutdown()
+            raise
+        self.connection = connection
+        self.capabilities = capabilities
+        self.uidvalidity = (
+            int(uidvalidity[0]) if uidvalidity and uidvalidity[0] else None
+        )
+
+    def has_capability(self, name: str) -> bool:
+        return name.upper() in self.capabilities
+
+    def noop(self):
+        status, _ = self.connection.noop()
+        if status != "OK":
+            raise imaplib.IMAP4.abort(f"NOOP failed: {status}")
+
+    def search_unseen(self) -> list[int]:
+        status, messages = self.connection.uid("SEARCH", None, "UNSEEN")
+        return _parse_uids(messages)
+
+    def search_since_uid(self, last_uid: int) -> list[int]:
+        """UIDs strictly greater than `last_uid` (server scans only that range)."""
+        status, messages = self.connection.uid("SEARCH", None, f"UID {last_uid + 1}:*")
+        # "n:*" always matches the highest UID, even when it is below n.
+        return [uid for uid in _parse_uids(messages) if uid > last_uid]
+
+    def highest_uid(self) -> int:
+        status, messages = self.connection.uid("SEARCH", None, "UID *")
+        uids = _parse_uids(messages)
+        return max(uids) if uids else 0
+
+    def _batches(self, items: list) -> list[list]:
+        size = max(1, self.settings.fetch_batch_size)
+        return [items[i : i + size] for i in range(0, len(items), size)]
+
+    def fetch_headers(self, uids: list[int]) -> dict:
+        """
+        Fetches only From/Subject/Message-ID and BODYSTRUCTURE of `uids`,
+        one round-trip per `fetch_batch_size` letters.
+        Returns UID -> (email.message.Message with those headers, parts), where
+        `parts` is the flattened BODYSTRUCTURE or None for single-part letters.
+        """
+        result = {}
+        for batch in self._batches(sorted(uids)):
+            status, msg_data = self.connection.uid(
+                "FETCH",
+                uid_set(batch),
+                f"(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])",
+            )
+            _check_fetch(status, msg_data)
+            for uid, items in parse_fetch_response(msg_data).items():
+                raw_headers = next(
+                    (v for k, v in items.items() if k.startswith("BODY[HEADER.FIELDS")),
+                    None,
+                )
+                result[uid] = (
+                    email.message_from_bytes(_as_bytes(raw_headers)),
+                    parse_bodystructure(items.get("BODYSTRUCTURE")),
+                )
+        return result
+
+    def fetch_emails(self, requests: list[tuple[int, list | None, bool]]) -> dict:
+        """
+        Downloads letters given as (uid, parts, with_attachments).
+
+        With `parts` (from `fetch_headers`) only the top-level header and the
+        parts EmailParser needs are transferred; text-only rules skip
+        attachments entirely and oversize attachments are skipped by their
+        declared size. Without `parts` the whole message is fetched.
+
+        Letters needing the same sections share one `UID FETCH <set>` per
+        `fetch_batch_size`, so a backlog costs a handful of round-trips.
+        Returns UID -> email.message.Message (missing UIDs are left out).
+        """
+        groups: dict[tuple[str, ...] | None, list] = {}
+        skipped_bytes = 0
+        for uid, parts, with_attachments in requests:
+            if not parts:
+                groups.setdefault(None, []).append((uid, None))
+                continue
+            needed, skipped = select_parts(
+                parts, with_attachments, EmailParser.MAX_ATTACHMENT_BYTES
+            )
+            skipped_bytes += skipped
+            key = tuple(part.section for part in needed)
+            groups.setdefault(key, []).append((uid, needed))
+
+        result = {}
+        fetched_bytes = 0
+        for sections, members in groups.items():
+            if sections is None:
+                spec = "BODY.PEEK[]"
+            else:
+                spec = " ".join(
+                    ["BODY.PEEK[HEADER]"]
+                    + [f"BODY.PEEK[{s}.MIME] BODY.PEEK[{s}]" for s in sections]
+                )
+            for batch in self._batches(members):
+                status, msg_data = self.connection.uid(
+                    "FETCH", uid_set([uid for uid, _ in batch]), f"(UID {spec})"
+                )
+                _check_fetch(status, msg_data)
+                parsed = parse_fetch_response(msg_data)
+                for uid, needed in batch:
+                    items = parsed.get(uid)
+                    if items is None:
+                        continue
+                    msg, size = _assemble(items, needed)
+                    fetched_bytes += size
+                    result[uid] = msg
+
+        metrics.inc(f"imap.bytes_fetched[{self.settings.username}]", fetched_bytes)
+        metrics.inc(f"imap.bytes_saved[{self.settings.username}]", skipped_bytes)
+        return result
+
+    def mark_as_seen(self, uids: list[int]):
+        """Sets \\Seen on all `uids`, one STORE per `fetch_batch_size` letters."""
+        for batch in self._batches(sorted(uids)):
+            self.connection.uid("STORE", uid_set(batch), "+FLAGS", "(\\Seen)")
+
+    def _readline(self, timeout: float) -> bytes | None:
+        """
+        `readline` that gives up after `timeout` seconds (None).
+        Goes through imaplib's buffered reader, so lines already read ahead
+        (e.g. an EXISTS in the same packet as "+ idling") are seen at once.
+        """
+        conn = self.connection
+        conn.sock.settimeout(max(timeout, 0.001))
+        try:
+            return conn.readline()
+        except TimeoutError:
+            # A socket file refuses further reads after a timeout; nothing
+            # was consumed (no complete line arrived), so a fresh one is safe.
+            conn.file = conn.sock.makefile("rb")
+            return None
+        finally:
+            conn.sock.settimeout(self.settings.timeout)
 
-    def search_unseen(self):
-        status, messages = self.connection.search(None, "UNSEEN")
-        mail_ids = messages[0].split() if messages and messages[0] else []
-        return mail_ids
+    def idle(self, timeout: float) -> bool:
+        """
+        Enters IMAP IDLE (RFC 2177) and blocks until the server reports new mail
+        (untagged EXISTS) or `timeout` seconds pass. Then leaves IDLE with DONE.
+        Returns True if new mail was announced.
 
-    def fetch_email(self, mail_id):
-        status, msg_data = self.connection.fetch(mail_id, "(RFC822)")
-        raw_email = msg_data[0][1]
-        return email.message_from_bytes(raw_email)
+        An EXISTS received during the previous commands (FETCH, STORE, ...)
+        already sits in `untagged_responses`; then IDLE is skipped. Untagged
+        data the server sends before the continuation is read the same way.
+        `interrupt` unblocks a running IDLE from another thread.
+        """
+        conn = self.connection
+        if self._interrupted:
+            return False
+        if conn.untagged_responses.pop("EXISTS", None):
+            return True
 
-    def mark_as_seen(self, mail_id):
-        self.connection.store(mail_id, "+FLAGS", "\\Seen")
+        tag = conn._new_tag()
+        conn.send(tag + b" IDLE\r\n")
+        has_new_mail = False
+        while True:
+            line = conn.readline()
+            if line.startswith(b"+"):
+                break
+            if not line or line.startswith(b"* BYE"):
+                raise imaplib.IMAP4.abort(f"connection closed entering IDLE: {line!r}")
+            if not line.startswith(b"*"):
+                # Tagged NO/BAD: the command is over, no DONE is expected.
+                raise imaplib.IMAP4.error(f"IDLE rejected: {line!r}")
+            if line.rstrip().endswith(b"EXISTS"):
+                has_new_mail = True
+
+        self._idling = True
+        try:
+            deadline = time.monotonic() + timeout
+            while not has_new_mail:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                line = self._readline(remaining)
+                if line is None:
+                    break
+                if not line or line.startswith(b"* BYE"):
+                    raise imaplib.IMAP4.abort(
+                        f"connection closed during IDLE: {line!r}"
+                    )
+                if line.startswith(b"*") and line.rstrip().endswith(b"EXISTS"):
+                    has_new_mail = True
+        finally:
+            self._idling = False
+
+        conn.send(b"DONE\r\n")
+        while True:
+            line = conn.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed while leaving IDLE")
+            if line.startswith(tag):
+                if not line[len(tag) :].strip().upper().startswith(b"OK"):
+                    raise imaplib.IMAP4.error(f"IDLE failed: {line!r}")
+                break
+            if line.rstrip().endswith(b"EXISTS"):
+                has_new_mail = True
+        return has_new_mail
+
+    def interrupt(self):
+        """
+        Thread-safe: ends a running IDLE at once by shutting the socket down
+        (its `readline` sees EOF); an IDLE that has not started yet is skipped.
+        """
+        self._interrupted = True
+        connection = self.connection
+        if self._idling and connection is not None:
+            with suppress(OSError):
+                connection.sock.shutdown(socket.SHUT_RDWR)
+
+    def abort(self):
+        """Drops a broken connection without the CLOSE/LOGOUT round-trips."""
+        if self.connection:
+            with suppress(Exception):
+                self.connection.shutdown()
+            self.connection = None
 
     def logout(self):
         if self.connection:
-            self.connection.close()
-            self.connection.logout()
+            try:
+                self.connection.close()
+                self.connection.logout()
+            except Exception:
+                self.abort()
             self.connection = None
+
+
+class AsyncMailClient:
+    """
+    Async facade over MailClient.
+
+    Every IMAP call runs on a dedicated single thread per mailbox, so blocking
+    socket I/O (TLS handshake, large RFC822 fetches, IDLE) never stalls the
+    event loop, and commands on one connection stay strictly ordered.
+    """
+
+    def __init__(self, settings: MailCheckSettings):
+        self.settings = settings
+        self._client = MailClient(settings)
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"imap-{settings.username}"
+        )
+
+    @property
+    def is_connected(self) -> bool:
+        return self._client.is_connected
+
+    def has_capability(self, name: str) -> bool:
+        return self._client.has_capability(name)
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    async def connect(self):
+        await self._call(self._client.connect)
+
+    async def noop(self):
+        await self._call(self._client.noop)
+
+    @property
+    def uidvalidity(self) -> int | None:
+        return self._client.uidvalidity
+
+    async def search_unseen(self) -> list[int]:
+        return await self._call(self._client.search_unseen)
+
+    async def search_since_uid(self, last_uid: int) -> list[int]:
+        return await self._call(self._client.search_since_uid, last_uid)
+
+    async def highest_uid(self) -> int:
+        return await self._call(self._client.highest_uid)
+
+    async def fetch_headers(self, uids: list[int]) -> dict:
+        return await self._call(self._client.fetch_headers, uids)
+
+    async def fetch_emails(self, requests: list[tuple[int, list | None, bool]]) -> dict:
+        return await self._call(self._client.fetch_emails, requests)
+
+    async def mark_as_seen(self, uids: list[int]):
+        await self._call(self._client.mark_as_seen, uids)
+
+    async def idle(self, timeout: float) -> bool:
+        return await self._call(self._client.idle, timeout)
+
+    def interrupt(self):
+        """Not queued on the mailbox thread: that thread may be the one in IDLE."""
+        self._client.interrupt()
+
+    async def abort(self):
+        await self._call(self._client.abort)
+
+    async def logout(self):
+        await self._call(self._client.logout)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
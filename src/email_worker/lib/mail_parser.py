@@ -5,6 +5,8 @@ from email.utils import parseaddr
 class EmailParser:
     """EMAIL PARSER WORKER"""
 
+    MAX_ATTACHMENT_BYTES = 5 * 1024 * 1024
+
     @staticmethod
     def decode_subject(subject_raw):
         decoded_parts = decode_header(subject_raw)
@@ -73,7 +75,6 @@ class EmailParser:
     def get_attachments(msg) -> list[tuple[str, bytes]]:
 
         attachments = []
-        MAX_SIZE_BYTES = 5 * 1024 * 1024
 
         for part in msg.walk():
             if (
@@ -96,7 +97,7 @@ class EmailParser:
                     final_filename = "".join(decoded_filename)
                     file_data = part.get_payload(decode=True)
 
-                    if file_data and len(file_data) <= MAX_SIZE_BYTES:
+                    if file_data and len(file_data) <= EmailParser.MAX_ATTACHMENT_BYTES:
                         attachments.append((final_filename, file_data))
 
         return attachments
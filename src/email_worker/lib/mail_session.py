@@ -0,0 +1,75 @@
+import imaplib
+import time
+
+from src.email_worker.lib.mail_client import AsyncMailClient
+from src.email_worker.schema import MailCheckSettings
+from src.metrics import metrics
+
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+
+
+class MailSession:
+    """
+    Long-lived IMAP session for one mailbox.
+
+    - Connects lazily and keeps the connection between poll cycles.
+    - Checks the connection with NOOP when it was idle longer than
+      `keepalive_interval` and reconnects if the server dropped it (BYE/timeout).
+    - All IMAP I/O runs on the mailbox's own thread (see AsyncMailClient).
+    """
+
+    def __init__(self, settings: MailCheckSettings):
+        self.settings = settings
+        self.client = AsyncMailClient(settings)
+        self._last_activity = 0.0
+        self._connected_once = False
+
+    @property
+    def _label(self) -> str:
+        return self.settings.username
+
+    async def _connect(self) -> None:
+        if self._connected_once:
+            metrics.inc(f"imap.reconnects[{self._label}]")
+        started = time.monotonic()
+        await self.client.connect()
+        metrics.observe(
+            f"imap.handshake_seconds[{self._label}]", time.monotonic() - started
+        )
+        self._connected_once = True
+        self._last_activity = time.monotonic()
+
+    async def ensure(self) -> AsyncMailClient:
+        """Returns a connected, healthy client."""
+        if not self.client.is_connected:
+            await self._connect()
+            return self.client
+
+        if time.monotonic() - self._last_activity >= self.settings.keepalive_interval:
+            try:
+                await self.client.noop()
+            except CONNECTION_ERRORS as e:
+                print(
+                    f"[IMAP] Соединение {self._label} потеряно ({e}). "
+                    "Переподключение..."
+                )
+                await self.client.abort()
+                await self._connect()
+        self._last_activity = time.monotonic()
+        return self.client
+
+    def touch(self) -> None:
+        self._last_activity = time.monotonic()
+
+    async def invalidate(self) -> None:
+        """Forgets a broken connection so the next `ensure` reconnects."""
+        await self.client.abort()
+
+    async def close(self) -> None:
+        # A running IDLE holds the mailbox thread for up to `idle_timeout`;
+        # unblock it first so LOGOUT (and interpreter exit) do not wait for it.
+        self.client.interrupt()
+        try:
+            await self.client.logout()
+        finally:
+            self.client.shutdown()
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import BaseModel
 
 
@@ -6,3 +8,10 @@ class MailCheckSettings(BaseModel):
     imap_port: int
     username: str
     password: str
+    timeout: int = 60
+    keepalive_interval: int = 60
+    mode: Literal["poll", "idle"] = "poll"
+    idle_timeout: int = 29 * 60
+    fetch_batch_size: int = 50
+    concurrency: int = 4
+    preserve_sender_order: bool = True
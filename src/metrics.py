@@ -0,0 +1,75 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """In-process counters, gauges and latency summaries."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = defaultdict(float)
+        self._gauges: dict[str, float] = {}
+        self._timings: dict[str, list[float]] = defaultdict(list)
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            self._timings[name].append(value)
+
+    def snapshot(self, reset_timings: bool = True) -> dict:
+        """
+        Возвращает текущее состояние метрик.
+        Для таймингов отдаёт count/avg/max/p95 за период с прошлого снимка.
+        """
+        with self._lock:
+            timings = {}
+            for name, values in self._timings.items():
+                if not values:
+                    continue
+                ordered = sorted(values)
+                timings[name] = {
+                    "count": len(ordered),
+                    "avg": sum(ordered) / len(ordered),
+                    "max": ordered[-1],
+                    "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                }
+            if reset_timings:
+                self._timings.clear()
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings": timings,
+            }
+
+
+metrics = Metrics()
+
+
+async def report_metrics(interval: int = 60) -> None:
+    """Периодически печатает снимок метрик в лог."""
+    while True:
+        await asyncio.sleep(interval)
+        snapshot = metrics.snapshot()
+        print(f"[METRICS] {snapshot}")
+
+
+async def monitor_loop_lag(interval: float = 0.5) -> None:
+    """
+    Измеряет задержку event loop: насколько позже запланированного
+    просыпается корутина. Постоянно высокая задержка = блокирующий код в loop.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        metrics.set_gauge("event_loop.lag_seconds", lag)
+        metrics.observe("event_loop.lag_seconds", lag)
@@ -0,0 +1,31 @@
+import random
+from urllib.parse import urlsplit
+
+from src.outbox.infra import BACKOFF_SCHEDULE, DELAY_BUCKETS
+from src.settings import OUTBOX_BACKOFF_JITTER, OUTBOX_BACKOFF_SCHEDULES
+
+
+def schedule_for(url: str) -> list[int]:
+    """Backoff schedule of the destination host, BACKOFF_SCHEDULE by default."""
+    host = urlsplit(url).netloc.lower()
+    return OUTBOX_BACKOFF_SCHEDULES.get(host) or BACKOFF_SCHEDULE
+
+
+def retry_delay(retry_count: int, url: str) -> float:
+    """
+    Delay in seconds before retry number `retry_count` (1-based).
+
+    The base delay comes from the destination schedule; up to
+    OUTBOX_BACKOFF_JITTER of it is randomly taken off, so messages that failed
+    together do not come back to the target in one synchronized wave.
+    """
+    schedule = schedule_for(url)
+    base = schedule[max(0, min(retry_count - 1, len(schedule) - 1))]
+    return base * (1 - OUTBOX_BACKOFF_JITTER * random.random())
+
+
+def delay_bucket(delay: float) -> int:
+    for bucket in DELAY_BUCKETS:
+        if delay <= bucket:
+            return bucket
+    return DELAY_BUCKETS[-1]
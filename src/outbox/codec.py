@@ -0,0 +1,60 @@
+import gzip
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+from src.metrics import metrics
+from src.settings import OUTBOX_COMPRESSION, OUTBOX_COMPRESSION_MIN_BYTES
+
+ZSTD = "zstd"
+GZIP = "gzip"
+
+
+def _codec() -> str | None:
+    if OUTBOX_COMPRESSION == ZSTD:
+        return ZSTD if zstandard is not None else GZIP
+    if OUTBOX_COMPRESSION == GZIP:
+        return GZIP
+    return None
+
+
+def encode_body(body: bytes) -> tuple[bytes, str | None]:
+    """
+    Compresses a message body above `OUTBOX_COMPRESSION_MIN_BYTES`.
+    Returns the body to publish and its content encoding (None = as is).
+    The compressed form is kept only if it is actually smaller.
+    """
+    metrics.inc("outbox.body_bytes", len(body))
+    codec = _codec()
+    if codec is None or len(body) < OUTBOX_COMPRESSION_MIN_BYTES:
+        metrics.inc("outbox.broker_bytes", len(body))
+        return body, None
+
+    if codec == ZSTD:
+        packed = zstandard.ZstdCompressor().compress(body)
+    else:
+        packed = gzip.compress(body, compresslevel=6)
+    if len(packed) >= len(body):
+        metrics.inc("outbox.broker_bytes", len(body))
+        return body, None
+
+    metrics.inc("outbox.broker_bytes", len(packed))
+    metrics.inc("outbox.bytes_saved", len(body) - len(packed))
+    return packed, codec
+
+
+def decode_body(body: bytes, content_encoding: str | None) -> bytes:
+    """Reverses `encode_body`; plain bodies from older producers pass through."""
+    if not content_encoding:
+        return body
+    if content_encoding == GZIP:
+        return gzip.decompress(body)
+    if content_encoding == ZSTD:
+        if zstandard is None:
+            raise RuntimeError(
+                "zstd-compressed message, but zstandard is not installed"
+            )
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    raise ValueError(f"Unsupported content encoding: {content_encoding}")
@@ -1,3 +1,5 @@
+import weakref
+
 import aio_pika
 
 EXCHANGE_MAIN = "outbound_http.exchange"
@@ -5,12 +7,42 @@ EXCHANGE_DLX = f"{EXCHANGE_MAIN}.dlx"
 QUEUE_MAIN = "outbound_http"
 ROUTING_MAIN = "outbound_http"
 BACKOFF_SCHEDULE = [30, 120, 600, 3600]
+# Delay queues for jittered retries. Each message carries its own expiration;
+# it lands in the smallest bucket >= its delay, so a short delay never waits
+# behind a much longer one at the head of the same queue.
+DELAY_BUCKETS = [5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600]
+# Messages that exhausted their retries wait here (no TTL) for a manual replay.
+QUEUE_PARKED = f"{QUEUE_MAIN}.parked"
+ROUTING_PARKED = f"{ROUTING_MAIN}.parked"
+
+
+_exchange_cache: "weakref.WeakKeyDictionary[aio_pika.abc.AbstractChannel, dict]" = (
+    weakref.WeakKeyDictionary()
+)
 
 
 def rkey_retry(ttl: int) -> str:
     return f"{ROUTING_MAIN}.retry.{ttl}s"
 
 
+def rkey_delay(bucket: int) -> str:
+    return f"{ROUTING_MAIN}.delay.{bucket}s"
+
+
+async def cached_exchange(
+    ch: aio_pika.abc.AbstractChannel, name: str
+) -> aio_pika.abc.AbstractExchange:
+    """
+    Exchange handle bound to `ch`, looked up once per channel.
+    The exchange must already exist (see `ensure_infra`), so no broker
+    round-trip is made.
+    """
+    exchanges = _exchange_cache.setdefault(ch, {})
+    if name not in exchanges:
+        exchanges[name] = await ch.get_exchange(name, ensure=False)
+    return exchanges[name]
+
+
 async def ensure_infra(ch: aio_pika.Channel) -> None:
     ex = await ch.declare_exchange(
         EXCHANGE_MAIN, aio_pika.ExchangeType.DIRECT, durable=True
@@ -38,3 +70,22 @@ async def ensure_infra(ch: aio_pika.Channel) -> None:
             },
         )
         await (await ch.get_queue(q)).bind(dlx, rkey_retry(ttl))
+
+    # Legacy fixed-TTL queues above stay declared so messages already parked
+    # in them still flow back to the main queue.
+    for bucket in DELAY_BUCKETS:
+        q = f"{QUEUE_MAIN}.delay.{bucket}s"
+        await ch.declare_queue(
+            q,
+            durable=True,
+            arguments={
+                # Upper bound; the per-message expiration is normally lower.
+                "x-message-ttl": bucket * 1000,
+                "x-dead-letter-exchange": EXCHANGE_MAIN,
+                "x-dead-letter-routing-key": ROUTING_MAIN,
+            },
+        )
+        await (await ch.get_queue(q)).bind(dlx, rkey_delay(bucket))
+
+    await ch.declare_queue(QUEUE_PARKED, durable=True)
+    await (await ch.get_queue(QUEUE_PARKED)).bind(dlx, ROUTING_PARKED)
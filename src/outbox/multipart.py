@@ -0,0 +1,43 @@
+from typing import Any
+
+from aiohttp import FormData
+
+from src.query_worker.form_data import fields_to_form_data, form_data_to_fields
+from src.storage.event_registry import event_registry
+
+
+async def pack_form_data(form_data: FormData) -> list[dict[str, Any]]:
+    """
+    Serializes FormData for an outbox message.
+    Text fields are kept inline; binary parts (files) are put into the
+    content-addressed blob storage and referenced by their sha256.
+    """
+    packed = []
+    for field in form_data_to_fields(form_data):
+        value = field.pop("value")
+        if isinstance(value, (bytes, bytearray)):
+            field["blob"] = await event_registry.store_blob(bytes(value))
+        else:
+            field["value"] = value if isinstance(value, str) else str(value)
+        packed.append(field)
+    return packed
+
+
+async def unpack_form_data(fields: list[dict[str, Any]]) -> FormData:
+    """Rebuilds FormData from `pack_form_data` output, loading blobs from disk."""
+    plain = []
+    for field in fields:
+        field = dict(field)
+        digest = field.pop("blob", None)
+        if digest is not None:
+            field["value"] = await event_registry.load_blob(digest)
+        plain.append(field)
+    return fields_to_form_data(plain)
+
+
+async def release_form_data(fields: list[dict[str, Any]]) -> None:
+    """Drops the blob references held by a packed message."""
+    for field in fields:
+        digest = field.get("blob")
+        if digest is not None:
+            await event_registry.release_blob(digest)
@@ -1,19 +1,249 @@
+import asyncio
 import json
+import time
+from contextlib import suppress
 from typing import Dict, Optional
 
 import aio_pika
+from aiohttp import FormData
 
+from src.metrics import metrics
+from src.outbox.codec import decode_body, encode_body
 from src.outbox.infra import EXCHANGE_MAIN, ROUTING_MAIN, ensure_infra
+from src.outbox.multipart import pack_form_data, release_form_data
 from src.outbox.rabbit import connect_rabbitmq
-from src.settings import RABBIT_URL
+from src.outbox.spill import SpillJournal, spill_journal
+from src.settings import (
+    OUTBOX_CONFIRM_WINDOW,
+    OUTBOX_PUBLISH_CHANNELS,
+    OUTBOX_PUBLISH_TIMEOUT_SECONDS,
+    OUTBOX_SPILL_DRAIN_BATCH,
+    RABBIT_URL,
+)
 
+SPILL_RETRY_SECONDS = 3
 
-async def enqueue_json_request(
-    method: str, url: str, headers: Optional[Dict[str, str]], json_body: Dict
-) -> None:
-    if not RABBIT_URL:
-        return
 
+def build_message(payload: dict, expiration: float | None = None) -> aio_pika.Message:
+    body, content_encoding = encode_body(
+        json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    )
+    return aio_pika.Message(
+        body=body,
+        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+        content_type="application/json",
+        content_encoding=content_encoding,
+        expiration=expiration,
+    )
+
+
+def read_message(msg: aio_pika.abc.AbstractIncomingMessage) -> dict:
+    """Payload of a message built by `build_message`."""
+    return json.loads(decode_body(msg.body, msg.content_encoding).decode("utf-8"))
+
+
+class OutboxPublisher:
+    """
+    Long-lived publisher for the outbox.
+
+    Keeps one robust connection and a small pool of confirm channels, each
+    with its exchange handle cached. Infrastructure is declared once per
+    connection instead of once per message.
+
+    `submit` publishes without waiting for the broker confirm: up to
+    `confirm_window` messages are in flight at once, pipelined over the
+    channels, and each caller gets a future that resolves when its confirm
+    lands (or fails if the broker nacks it).
+
+    The connection is made in the background. While the broker is
+    unreachable payloads are written to the local spill journal instead,
+    and a drain task forwards them in order once the broker is back. New
+    payloads keep going to the journal until it is empty, so ordering is
+    preserved.
+    """
+
+    def __init__(
+        self, pool_size: int, confirm_window: int, journal: SpillJournal
+    ) -> None:
+        self._pool_size = max(1, pool_size)
+        self._connection: aio_pika.RobustConnection | None = None
+        self._channels: list[tuple[aio_pika.Channel, aio_pika.Exchange]] = []
+        self._next_channel = 0
+        self._window = asyncio.Semaphore(max(1, confirm_window))
+        self._in_flight = 0
+        self._journal = journal
+        self._spilling: bool | None = None
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Starts the background connect/drain task (idempotent)."""
+        if not RABBIT_URL:
+            return
+        if self._spilling is None:
+            self._spilling = self._journal.count() > 0
+            self._wake = asyncio.Event()
+            if self._spilling:
+                self._wake.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _open_channel(self) -> tuple[aio_pika.Channel, aio_pika.Exchange]:
+        ch = await self._connection.channel(publisher_confirms=True)
+        ex = await ch.get_exchange(EXCHANGE_MAIN, ensure=False)
+        return ch, ex
+
+    async def _connect(self) -> None:
+        if self._connection is not None and not self._connection.is_closed:
+            return
+        self._channels = []
+        connection = await connect_rabbitmq()
+        ch = await connection.channel(publisher_confirms=True)
+        await ensure_infra(ch)
+        await ch.close()
+
+        self._connection = connection
+        self._channels = [await self._open_channel() for _ in range(self._pool_size)]
+
+    async def _exchange(self) -> aio_pika.Exchange:
+        """Round-robin over the pooled channels; channels are shared, not leased."""
+        if not self._channels or self._connection.is_closed:
+            raise ConnectionError("RabbitMQ connection is not ready")
+        index = self._next_channel % len(self._channels)
+        self._next_channel += 1
+        ch, ex = self._channels[index]
+        if ch.is_closed:
+            ch, ex = await self._open_channel()
+            self._channels[index] = (ch, ex)
+        return ex
+
+    async def _send(self, payload: dict) -> None:
+        ex = await self._exchange()
+        await ex.publish(
+            build_message(payload),
+            routing_key=ROUTING_MAIN,
+            timeout=OUTBOX_PUBLISH_TIMEOUT_SECONDS,
+        )
+
+    def _spill(self, payload: dict) -> None:
+        if not self._spilling:
+            print(
+                "[OUTBOX] Broker unavailable, buffering messages in the spill journal."
+            )
+        self._spilling = True
+        self._journal.append(payload)
+        self._wake.set()
+        metrics.inc("outbox.spilled")
+
+    async def publish(self, payload: dict) -> None:
+        """
+        Publishes and waits for the broker confirm, or for the local journal
+        write when the broker is unavailable.
+        """
+        if not RABBIT_URL:
+            # Nothing would ever drain the journal: refuse instead of
+            # reporting the message as delivered.
+            raise RuntimeError("RABBIT_URL is not set: the outbox is disabled")
+        self.start()
+        started = time.monotonic()
+        if self._spilling:
+            self._spill(payload)
+            return
+        try:
+            await self._send(payload)
+        except Exception as e:
+            print(f"[OUTBOX] Publish failed ({e}), spilling to the journal.")
+            self._spill(payload)
+            return
+        metrics.observe("outbox.publish_seconds", time.monotonic() - started)
+        metrics.inc("outbox.published")
+
+    async def _drain(self) -> None:
+        while True:
+            rows = self._journal.peek(OUTBOX_SPILL_DRAIN_BATCH)
+            if not rows:
+                # No await since the check: nothing can be appended in between.
+                self._spilling = False
+                print("[OUTBOX] Spill journal drained.")
+                return
+            # One by one, in journal order; a row is deleted after its confirm.
+            for row_id, payload in rows:
+                await self._send(payload)
+                self._journal.delete_through(row_id)
+                metrics.inc("outbox.spill_drained")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._connect()
+                await self._wake.wait()
+                self._wake.clear()
+                await self._drain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[OUTBOX] Spill drain interrupted: {e}")
+                self._wake.set()
+                await asyncio.sleep(SPILL_RETRY_SECONDS)
+            finally:
+                metrics.set_gauge("outbox.spill_depth", self._journal.count())
+
+    async def _publish_in_window(self, payload: dict) -> None:
+        try:
+            await self.publish(payload)
+        finally:
+            self._in_flight -= 1
+            metrics.set_gauge("outbox.confirms_in_flight", self._in_flight)
+            self._window.release()
+
+    async def submit(self, payload: dict) -> asyncio.Task:
+        """
+        Starts publishing `payload` and returns a task that completes on
+        confirm. Waits only while the confirm window is full (backpressure).
+        """
+        await self._window.acquire()
+        self._in_flight += 1
+        metrics.set_gauge("outbox.confirms_in_flight", self._in_flight)
+        return asyncio.create_task(self._publish_in_window(payload))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        if self._connection is not None and not self._connection.is_closed:
+            with suppress(Exception):
+                await self._connection.close()
+        self._connection = None
+        self._channels = []
+        self._journal.close()
+
+
+outbox_publisher = OutboxPublisher(
+    OUTBOX_PUBLISH_CHANNELS, OUTBOX_CONFIRM_WINDOW, spill_journal
+)
+
+
+async def _enqueue(payload: dict, wait: bool) -> Optional[asyncio.Task]:
+    if wait:
+        await outbox_publisher.publish(payload)
+        return None
+    return await outbox_publisher.submit(payload)
+
+
+async def enqueue_json_request(
+    method: str,
+    url: str,
+    headers: Optional[Dict[str, str]],
+    json_body: Dict,
+    wait: bool = True,
+) -> Optional[asyncio.Task]:
+    """
+    Puts a JSON request into the outbox.
+    With `wait=False` returns a task that completes on the broker confirm
+    instead of waiting for it.
+    """
     payload = {
         "kind": "json",
         "method": method,
@@ -22,15 +252,45 @@ async def enqueue_json_request(
         "json": json_body,
         "retry_count": 0,
     }
+    return await _enqueue(payload, wait)
 
-    conn = await connect_rabbitmq()
-    async with conn:
-        ch = await conn.channel(publisher_confirms=True)
-        await ensure_infra(ch)
-        ex = await ch.get_exchange(EXCHANGE_MAIN)
-        msg = aio_pika.Message(
-            body=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
-            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-            content_type="application/json",
-        )
-        await ex.publish(msg, routing_key=ROUTING_MAIN)
+
+async def _release_on_failure(confirm: asyncio.Task, fields: list) -> None:
+    try:
+        await confirm
+    except Exception:
+        await release_form_data(fields)
+        raise
+
+
+async def enqueue_form_request(
+    method: str,
+    url: str,
+    headers: Optional[Dict[str, str]],
+    form_data: FormData,
+    wait: bool = True,
+) -> Optional[asyncio.Task]:
+    """
+    Puts a multipart/form-data request into the outbox.
+    File parts are stored once in the blob storage and referenced by hash;
+    the consumer reassembles the FormData at send time.
+    Same `wait` semantics as `enqueue_json_request`.
+    """
+    fields = await pack_form_data(form_data)
+    payload = {
+        "kind": "multipart",
+        "method": method,
+        "url": url,
+        "headers": headers or {},
+        "fields": fields,
+        "retry_count": 0,
+    }
+    if wait:
+        try:
+            await outbox_publisher.publish(payload)
+        except Exception:
+            await release_form_data(fields)
+            raise
+        return None
+    confirm = await outbox_publisher.submit(payload)
+    return asyncio.create_task(_release_on_failure(confirm, fields))
@@ -0,0 +1,162 @@
+"""
+Replays parked outbox messages (retries exhausted) back into the main queue.
+
+    python -m src.outbox.replay --rate 5 --url-contains crm.example --older-than 600
+
+Walks the parked queue once (as many messages as it held at start).
+Matching messages are re-published to the main queue with a fresh retry
+budget, at most `--rate` per second, and while the main queue backlog stays
+under `--max-backlog`, so a recovering target is not flooded again.
+Non-matching messages are moved back to the tail of the parked queue.
+Every message is acked only after its re-publish was confirmed.
+"""
+
+import argparse
+import asyncio
+import time
+
+import aio_pika
+
+from src.outbox.infra import (
+    EXCHANGE_DLX,
+    EXCHANGE_MAIN,
+    QUEUE_MAIN,
+    QUEUE_PARKED,
+    ROUTING_MAIN,
+    ROUTING_PARKED,
+    ensure_infra,
+)
+from src.outbox.producer import build_message, read_message
+from src.outbox.rabbit import connect_rabbitmq
+from src.settings import RABBIT_URL
+
+BACKLOG_POLL_SECONDS = 1.0
+
+
+class TokenBucket:
+    """`rate` tokens per second, bursts of at most `burst`."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self._rate = rate
+        self._capacity = max(1, burst)
+        self._tokens = float(self._capacity)
+        self._updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._updated) * self._rate
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+def _matches(payload: dict, args: argparse.Namespace, now: float) -> bool:
+    if args.url_contains and args.url_contains not in payload.get("url", ""):
+        return False
+    age = now - float(payload.get("parked_at", now))
+    if args.older_than is not None and age < args.older_than:
+        return False
+    if args.newer_than is not None and age > args.newer_than:
+        return False
+    return True
+
+
+async def _wait_for_backlog(ch: aio_pika.Channel, max_backlog: int) -> None:
+    while True:
+        main_queue = await ch.declare_queue(QUEUE_MAIN, passive=True)
+        if main_queue.declaration_result.message_count < max_backlog:
+            return
+        await asyncio.sleep(BACKLOG_POLL_SECONDS)
+
+
+async def replay(args: argparse.Namespace) -> dict:
+    stats = {"scanned": 0, "replayed": 0, "kept": 0}
+    if not RABBIT_URL:
+        print("RABBIT_URL is not set, nothing to replay.")
+        return stats
+
+    conn = await connect_rabbitmq()
+    async with conn:
+        ch = await conn.channel(publisher_confirms=True)
+        await ensure_infra(ch)
+        main_ex = await ch.get_exchange(EXCHANGE_MAIN, ensure=False)
+        dlx = await ch.get_exchange(EXCHANGE_DLX, ensure=False)
+        parked = await ch.declare_queue(QUEUE_PARKED, durable=True, passive=True)
+        total = parked.declaration_result.message_count
+        print(f"Parked messages: {total}.")
+
+        bucket = TokenBucket(args.rate, args.burst)
+        now = time.time()
+        for _ in range(total):
+            if args.limit is not None and stats["replayed"] >= args.limit:
+                break
+            msg = await parked.get(no_ack=False, fail=False)
+            if msg is None:
+                break
+            stats["scanned"] += 1
+            payload = read_message(msg)
+
+            if not _matches(payload, args, now):
+                stats["kept"] += 1
+                if not args.dry_run:
+                    await dlx.publish(
+                        build_message(payload), routing_key=ROUTING_PARKED
+                    )
+                    await msg.ack()
+                continue
+
+            stats["replayed"] += 1
+            if args.dry_run:
+                print(f"  would replay: {payload.get('method')} {payload.get('url')}")
+                continue
+
+            await bucket.acquire()
+            if (stats["replayed"] - 1) % max(1, int(args.rate)) == 0:
+                await _wait_for_backlog(ch, args.max_backlog)
+            payload["retry_count"] = 0
+            payload.pop("parked_at", None)
+            payload.pop("last_error", None)
+            await main_ex.publish(build_message(payload), routing_key=ROUTING_MAIN)
+            await msg.ack()
+        # Dry run: nothing was acked, closing the connection requeues it all.
+
+    print(
+        f"Scanned {stats['scanned']}, "
+        f"{'would replay' if args.dry_run else 'replayed'} {stats['replayed']}, "
+        f"kept parked {stats['kept']}."
+    )
+    return stats
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate", type=float, default=5.0, help="messages per second")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--url-contains", default=None)
+    parser.add_argument(
+        "--older-than", type=float, default=None, help="parked at least N seconds ago"
+    )
+    parser.add_argument(
+        "--newer-than", type=float, default=None, help="parked at most N seconds ago"
+    )
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument(
+        "--max-backlog",
+        type=int,
+        default=500,
+        help="pause while the main queue holds this many messages",
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+    if args.rate <= 0:
+        parser.error("--rate must be positive")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(replay(parse_args()))
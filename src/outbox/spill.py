@@ -0,0 +1,75 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from src.settings import OUTBOX_SPILL_PATH
+
+
+class SpillJournal:
+    """
+    Append-only on-disk journal for outbox payloads (SQLite in WAL mode).
+
+    An append is a single small transaction, well under a millisecond, so it
+    is done directly from the event loop. With `synchronous=NORMAL` a commit
+    survives a process crash; only an OS crash can lose the last entries.
+    Rows are read back in insertion order and deleted once published.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(
+                self._path, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS spill ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " payload TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def append(self, payload: dict) -> int:
+        body = json.dumps(payload, ensure_ascii=False)
+        with self._lock:
+            cursor = self._db().execute(
+                "INSERT INTO spill (payload, created_at) VALUES (?, ?)",
+                (body, time.time()),
+            )
+            return cursor.lastrowid
+
+    def peek(self, limit: int) -> list[tuple[int, dict]]:
+        with self._lock:
+            rows = (
+                self._db()
+                .execute("SELECT id, payload FROM spill ORDER BY id LIMIT ?", (limit,))
+                .fetchall()
+            )
+        return [(row_id, json.loads(body)) for row_id, body in rows]
+
+    def delete_through(self, row_id: int) -> None:
+        with self._lock:
+            self._db().execute("DELETE FROM spill WHERE id <= ?", (row_id,))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM spill").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+spill_journal = SpillJournal(OUTBOX_SPILL_PATH)
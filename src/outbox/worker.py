@@ -1,54 +1,108 @@
 import asyncio
-import json
 import os
+import time
 from contextlib import suppress
+from functools import partial
+from urllib.parse import urlsplit
 
 import aio_pika
 
-from src.outbox.infra import (BACKOFF_SCHEDULE, EXCHANGE_DLX, QUEUE_MAIN,
-                              ensure_infra, rkey_retry)
+from src.metrics import metrics
+from src.outbox.backoff import delay_bucket, retry_delay
+from src.outbox.infra import (
+    EXCHANGE_DLX,
+    QUEUE_MAIN,
+    ROUTING_PARKED,
+    cached_exchange,
+    ensure_infra,
+    rkey_delay,
+)
+from src.outbox.multipart import release_form_data, unpack_form_data
+from src.outbox.producer import build_message, read_message
 from src.outbox.rabbit import connect_rabbitmq
+from src.query_worker.circuit_breaker import CircuitOpenError, circuit_breakers
 from src.query_worker.request_sender import send_request
-from src.settings import RABBIT_URL
+from src.settings import (
+    OUTBOX_MAX_IN_FLIGHT,
+    OUTBOX_PER_HOST_CONCURRENCY,
+    OUTBOX_PREFETCH,
+    RABBIT_URL,
+)
 
 MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "8"))
 
+_in_flight = asyncio.Semaphore(OUTBOX_MAX_IN_FLIGHT)
+_host_limits: dict[str, asyncio.Semaphore] = {}
 
-def _next_ttl(n: int) -> int:
-    i = max(0, min(n - 1, len(BACKOFF_SCHEDULE) - 1))
-    return BACKOFF_SCHEDULE[i]
 
+def _host_limit(url: str) -> asyncio.Semaphore:
+    """Per-target-host cap, so one slow endpoint cannot take every slot."""
+    host = urlsplit(url).netloc.lower()
+    if host not in _host_limits:
+        _host_limits[host] = asyncio.Semaphore(OUTBOX_PER_HOST_CONCURRENCY)
+    return _host_limits[host]
 
-async def _republish_retry(ch: aio_pika.Channel, payload: dict) -> None:
-    ttl = _next_ttl(int(payload.get("retry_count", 0)))
-    dlx = await ch.declare_exchange(
-        EXCHANGE_DLX, aio_pika.ExchangeType.DIRECT, durable=True
-    )
-    msg = aio_pika.Message(
-        body=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
-        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-        content_type="application/json",
+
+async def _republish_retry(retry_channel: aio_pika.Channel, payload: dict) -> None:
+    delay = retry_delay(int(payload.get("retry_count", 0)), payload.get("url", ""))
+    metrics.observe("outbox.retry_delay_seconds", delay)
+    dlx = await cached_exchange(retry_channel, EXCHANGE_DLX)
+    await dlx.publish(
+        build_message(payload, expiration=delay),
+        routing_key=rkey_delay(delay_bucket(delay)),
     )
-    await dlx.publish(msg, routing_key=rkey_retry(ttl))
 
 
-async def _handle(msg: aio_pika.IncomingMessage) -> None:
+async def _park(
+    retry_channel: aio_pika.Channel, payload: dict, error: Exception
+) -> None:
+    """
+    Moves a message that exhausted its retries to the parked queue.
+    Multipart blobs are kept: the message can still be replayed
+    (see `src.outbox.replay`).
+    """
+    payload["parked_at"] = time.time()
+    payload["last_error"] = f"{type(error).__name__}: {error}"[:500]
+    dlx = await cached_exchange(retry_channel, EXCHANGE_DLX)
+    await dlx.publish(build_message(payload), routing_key=ROUTING_PARKED)
+    metrics.inc("outbox.parked")
+    print(f"[OUTBOX] Retries exhausted for {payload.get('url')}, message parked.")
+
+
+async def _handle(
+    msg: aio_pika.IncomingMessage, retry_channel: aio_pika.Channel
+) -> None:
     async with msg.process(requeue=False):
-        payload = json.loads(msg.body.decode("utf-8"))
+        payload = read_message(msg)
         try:
-            if payload.get("kind") != "json":
+            kind = payload.get("kind")
+            if kind not in ("json", "multipart"):
                 return
-            await send_request(
-                method=payload["method"],
-                url=payload["url"],
-                headers=payload["headers"],
-                data=payload["json"],
-            )
-        except Exception:
+            if circuit_breakers.for_url(payload["url"]).is_open():
+                # Target is down: straight to the retry path, no slot taken.
+                raise CircuitOpenError(payload["url"])
+            # Host cap first: deliveries waiting for a busy host must not hold
+            # global slots that other hosts could use.
+            async with _host_limit(payload["url"]), _in_flight:
+                data = (
+                    payload["json"]
+                    if kind == "json"
+                    else await unpack_form_data(payload["fields"])
+                )
+                await send_request(
+                    method=payload["method"],
+                    url=payload["url"],
+                    headers=payload["headers"],
+                    data=data,
+                )
+            if kind == "multipart":
+                await release_form_data(payload["fields"])
+        except Exception as e:
             payload["retry_count"] = int(payload.get("retry_count", 0)) + 1
             if payload["retry_count"] > MAX_RETRIES:
+                await _park(retry_channel, payload, e)
                 return
-            await _republish_retry(msg.channel, payload)
+            await _republish_retry(retry_channel, payload)
 
 
 async def run_consumer(stop_event: asyncio.Event | None = None) -> None:
@@ -60,9 +114,13 @@ async def run_consumer(stop_event: asyncio.Event | None = None) -> None:
         conn = await connect_rabbitmq()
         async with conn:
             ch = await conn.channel()
+            await ch.set_qos(prefetch_count=OUTBOX_PREFETCH)
             await ensure_infra(ch)
+            # Retries go through their own confirm channel, so a retry storm
+            # does not interleave with deliveries on the consuming channel.
+            retry_channel = await conn.channel(publisher_confirms=True)
             q = await ch.get_queue(QUEUE_MAIN)
-            await q.consume(_handle, no_ack=False)
+            await q.consume(partial(_handle, retry_channel=retry_channel), no_ack=False)
             if stop_event is None:
                 await asyncio.Future()
             else:
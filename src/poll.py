@@ -1,7 +1,41 @@
 import asyncio
+import imaplib
 from typing import Awaitable, Callable
 
+from src.email_worker.lib.mail_session import CONNECTION_ERRORS, MailSession
 from src.email_worker.schema import MailCheckSettings
+from src.metrics import metrics
+
+
+async def _wait_idle(session: MailSession, interval: int) -> None:
+    """
+    Blocks in IMAP IDLE until the server announces new mail or `idle_timeout`
+    passes (then the next cycle re-enters IDLE, as RFC 2177 recommends < 30 min).
+    Falls back to a plain `interval` sleep when the server lacks IDLE.
+    """
+    settings = session.settings
+    try:
+        client = await session.ensure()
+        if not client.has_capability("IDLE"):
+            print(f"[IDLE] {settings.username}: сервер не поддерживает IDLE, опрос.")
+            await asyncio.sleep(interval)
+            return
+        has_new_mail = await client.idle(settings.idle_timeout)
+        session.touch()
+        metrics.inc(
+            f"imap.idle_wakeups[{settings.username}]"
+            if has_new_mail
+            else f"imap.idle_timeouts[{settings.username}]"
+        )
+    except CONNECTION_ERRORS as e:
+        print(f"[IDLE] {settings.username}: соединение разорвано: {e}")
+        await session.invalidate()
+        await asyncio.sleep(interval)
+    except imaplib.IMAP4.error as e:
+        # IDLE rejected or failed: start over with a fresh connection.
+        print(f"[IDLE] {settings.username}: ошибка IMAP: {e}")
+        await session.invalidate()
+        await asyncio.sleep(interval)
 
 
 async def poll_mail(
@@ -12,11 +46,21 @@ async def poll_mail(
 ):
     """
     Periodically calls an ASYNCHRONOUS worker function.
+    The IMAP session is kept open and reused across cycles.
+    With `settings.mode == "idle"` the next cycle starts as soon as the server
+    pushes new mail instead of after a fixed `interval`.
     """
-    while True:
-        try:
-            await worker(settings=settings, rules=rules)
-        except Exception as e:
-            print(f"[ERROR] in poller for {settings.username}: {e}")
+    session = MailSession(settings)
+    try:
+        while True:
+            try:
+                await worker(settings=settings, rules=rules, session=session)
+            except Exception as e:
+                print(f"[ERROR] in poller for {settings.username}: {e}")
 
-        await asyncio.sleep(interval)
+            if settings.mode == "idle":
+                await _wait_idle(session, interval)
+            else:
+                await asyncio.sleep(interval)
+    finally:
+        await session.close()
@@ -0,0 +1,134 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from aiohttp import FormData
+
+from src.metrics import metrics
+from src.query_worker.form_data import fields_to_form_data, form_data_to_fields
+from src.settings import PROCESSOR_POOL_SIZE, PROCESSOR_TIMEOUT_SECONDS
+
+
+def _to_plain(result: Any) -> tuple[str, Any]:
+    if isinstance(result, FormData):
+        return ("form", form_data_to_fields(result))
+    if (
+        isinstance(result, list)
+        and result
+        and all(isinstance(item, FormData) for item in result)
+    ):
+        return ("forms", [form_data_to_fields(item) for item in result])
+    return ("raw", result)
+
+
+def _from_plain(plain: tuple[str, Any]) -> Any:
+    kind, value = plain
+    if kind == "form":
+        return fields_to_form_data(value)
+    if kind == "forms":
+        return [fields_to_form_data(item) for item in value]
+    return value
+
+
+def _run_processor(
+    processor: Callable,
+    content: str | None,
+    subject: str,
+    sender: str,
+    attachments: list[tuple[str, bytes]] | None,
+) -> tuple[str, Any]:
+    """Runs in a worker process; returns a picklable result."""
+    return _to_plain(processor(content, subject, sender, attachments))
+
+
+class ProcessorPool:
+    """
+    Runs letter processors (pandas/PDF/regex heavy) in worker processes so
+    they do not block the event loop shared by pollers and the outbox consumer.
+
+    Processor results are converted to plain data in the worker (FormData ->
+    list of fields) and turned back into FormData in the main process.
+    With `size == 0` processors run inline, as before.
+    """
+
+    def __init__(self, size: int, timeout: int) -> None:
+        self._size = size
+        self._timeout = timeout
+        self._executor: ProcessPoolExecutor | None = None
+        self._in_flight = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._size,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            metrics.set_gauge("processor_pool.size", self._size)
+        return self._executor
+
+    async def run(
+        self,
+        processor: Callable,
+        content: str | None,
+        subject: str,
+        sender: str,
+        attachments: list[tuple[str, bytes]] | None,
+    ) -> Any:
+        if self._size <= 0:
+            return processor(content, subject, sender, attachments)
+
+        loop = asyncio.get_running_loop()
+        self._in_flight += 1
+        metrics.set_gauge("processor_pool.queue_depth", self._in_flight)
+        started = time.monotonic()
+        executor = self._get_executor()
+        try:
+            future = loop.run_in_executor(
+                executor,
+                _run_processor,
+                processor,
+                content,
+                subject,
+                sender,
+                attachments,
+            )
+            plain = await asyncio.wait_for(future, timeout=self._timeout)
+        except asyncio.TimeoutError:
+            # A process cannot be told to drop one task: a hung processor would
+            # keep its worker busy for good. Kill the pool and start a new one;
+            # other tasks running in it fail and their letters are retried.
+            metrics.inc("processor_pool.timeouts")
+            self._kill(executor)
+            raise TimeoutError(
+                f"Processor {getattr(processor, '__name__', processor)} "
+                f"exceeded {self._timeout}s"
+            )
+        except BrokenProcessPool:
+            metrics.inc("processor_pool.broken")
+            if self._executor is executor:
+                self._executor = None
+            raise
+        finally:
+            self._in_flight -= 1
+            metrics.set_gauge("processor_pool.queue_depth", self._in_flight)
+            metrics.observe("processor_pool.task_seconds", time.monotonic() - started)
+        return _from_plain(plain)
+
+    def _kill(self, executor: ProcessPoolExecutor) -> None:
+        if self._executor is executor:
+            self._executor = None
+        # No public API to stop workers before Python 3.14.
+        for process in list((executor._processes or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+processor_pool = ProcessorPool(PROCESSOR_POOL_SIZE, PROCESSOR_TIMEOUT_SECONDS)
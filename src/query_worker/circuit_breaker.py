@@ -0,0 +1,108 @@
+import time
+from urllib.parse import urlsplit
+
+from src.metrics import metrics
+from src.settings import (
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_HALF_OPEN_PROBES,
+    CIRCUIT_RESET_SECONDS,
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """The destination host is considered down; the request was not sent."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one destination host.
+
+    - closed: requests pass; `failure_threshold` consecutive failures open it.
+    - open: requests fail immediately with CircuitOpenError for `reset_timeout`.
+    - half_open: up to `half_open_probes` requests are let through; a success
+      closes the circuit, a failure opens it again.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        half_open_probes: int,
+    ) -> None:
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probes = 0
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            print(f"[CIRCUIT] {self.host}: {self.state} -> {state}")
+        self.state = state
+        metrics.set_gauge(f"http.circuit_state[{self.host}]", _STATE_GAUGE[state])
+
+    def is_open(self) -> bool:
+        """True while requests would be rejected (does not take a probe slot)."""
+        return (
+            self.state == OPEN
+            and time.monotonic() - self.opened_at < self.reset_timeout
+        )
+
+    def before_request(self) -> None:
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                metrics.inc(f"http.circuit_rejected[{self.host}]")
+                raise CircuitOpenError(f"circuit for {self.host} is open")
+            self._set_state(HALF_OPEN)
+            self._probes = 0
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                metrics.inc(f"http.circuit_rejected[{self.host}]")
+                raise CircuitOpenError(f"circuit for {self.host} is half-open")
+            self._probes += 1
+
+    def release_probe(self) -> None:
+        """Returns a half-open probe slot whose request ended without a verdict."""
+        if self.state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+
+class CircuitBreakerRegistry:
+    """Breakers keyed by target host, shared by every outbound sender."""
+
+    def __init__(self) -> None:
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def for_url(self, url: str) -> CircuitBreaker:
+        host = urlsplit(url).netloc.lower()
+        if host not in self._breakers:
+            self._breakers[host] = CircuitBreaker(
+                host,
+                CIRCUIT_FAILURE_THRESHOLD,
+                CIRCUIT_RESET_SECONDS,
+                CIRCUIT_HALF_OPEN_PROBES,
+            )
+        return self._breakers[host]
+
+
+circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,36 @@
+from typing import Any
+
+from aiohttp import FormData
+
+
+def form_data_to_fields(form_data: FormData) -> list[dict[str, Any]]:
+    """
+    Converts FormData into a plain, picklable/JSON-friendly list of fields:
+    [{"name", "value", "filename", "content_type"}, ...].
+    """
+    fields = []
+    for type_options, _headers, value in getattr(form_data, "_fields", []):
+        if hasattr(value, "read"):
+            value = value.read()
+        fields.append(
+            {
+                "name": type_options.get("name"),
+                "value": value,
+                "filename": type_options.get("filename"),
+                "content_type": type_options.get("content_type"),
+            }
+        )
+    return fields
+
+
+def fields_to_form_data(fields: list[dict[str, Any]]) -> FormData:
+    """Inverse of `form_data_to_fields`."""
+    form_data = FormData()
+    for field in fields:
+        form_data.add_field(
+            field["name"],
+            field["value"],
+            filename=field.get("filename"),
+            content_type=field.get("content_type"),
+        )
+    return form_data
@@ -0,0 +1,45 @@
+import aiohttp
+
+from src.settings import (
+    HTTP_CONNECT_TIMEOUT_SECONDS,
+    HTTP_DNS_CACHE_TTL,
+    HTTP_KEEPALIVE_SECONDS,
+    HTTP_POOL_LIMIT,
+    HTTP_POOL_LIMIT_PER_HOST,
+    HTTP_TIMEOUT_SECONDS,
+)
+
+
+class HttpSessionRegistry:
+    """
+    Application-lifetime aiohttp session.
+
+    One connector is shared by all outbound requests: keep-alive connections
+    are reused, connections per host are capped and DNS answers are cached.
+    Closed once on shutdown from main.py.
+    """
+
+    def __init__(self) -> None:
+        self._session: aiohttp.ClientSession | None = None
+
+    def get(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+                keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+http_sessions = HttpSessionRegistry()
@@ -1,5 +1,9 @@
-import aiohttp
+import asyncio
 
+from aiohttp import ClientResponseError
+
+from src.query_worker.circuit_breaker import circuit_breakers
+from src.query_worker.http_session import http_sessions
 from src.query_worker.schema import HTTPMethod
 
 
@@ -15,15 +19,33 @@ async def send_request(
     - Если `data` - это dict, отправляет запрос с Content-Type: application/json.
     - Если `data` - это aiohttp.FormData, отправляет как multipart/form-data.
     - В остальных случаях отправляет `data` как есть.
+
+    Использует общую сессию приложения (пул keep-alive соединений).
+    Запросы к хосту с открытым circuit breaker не отправляются:
+    сразу выбрасывается CircuitOpenError. Ошибки соединения и ответы 5xx
+    считаются отказами хоста; на 5xx выбрасывается ClientResponseError,
+    чтобы запрос ушёл на повтор, а не считался доставленным.
     """
-    async with aiohttp.ClientSession() as session:
-        if isinstance(data, dict):
-            async with session.request(
-                method, url, headers=headers, json=data
-            ) as response:
-                return await response.text()
-        else:
-            async with session.request(
-                method, url, headers=headers, data=data
-            ) as response:
-                return await response.text()
+    breaker = circuit_breakers.for_url(url)
+    breaker.before_request()
+    session = http_sessions.get()
+    body = {"json": data} if isinstance(data, dict) else {"data": data}
+    try:
+        async with session.request(method, url, headers=headers, **body) as response:
+            text = await response.text()
+    except asyncio.CancelledError:
+        breaker.release_probe()
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    if response.status >= 500:
+        breaker.record_failure()
+        raise ClientResponseError(
+            response.request_info,
+            response.history,
+            status=response.status,
+            message=text[:200],
+        )
+    breaker.record_success()
+    return text
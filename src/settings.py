@@ -1,3 +1,4 @@
+import json
 import os
 from pathlib import Path
 
@@ -13,24 +14,32 @@ APPOINTMENT_IMAP_SERVER = os.getenv("APPOINTMENT_IMAP_SERVER")
 APPOINTMENT_IMAP_PORT = int(os.getenv("APPOINTMENT_IMAP_PORT"))
 APPOINTMENT_USERNAME = os.getenv("APPOINTMENT_USERNAME")
 APPOINTMENT_PASSWORD = os.getenv("APPOINTMENT_PASSWORD")
+APPOINTMENT_MAIL_MODE = os.getenv("APPOINTMENT_MAIL_MODE", "poll")
+APPOINTMENT_CONCURRENCY = int(os.getenv("APPOINTMENT_CONCURRENCY", "4"))
 
 appointment_mail_settings = MailCheckSettings(
     imap_server=APPOINTMENT_IMAP_SERVER,
     imap_port=APPOINTMENT_IMAP_PORT,
     username=APPOINTMENT_USERNAME,
     password=APPOINTMENT_PASSWORD,
+    mode=APPOINTMENT_MAIL_MODE,
+    concurrency=APPOINTMENT_CONCURRENCY,
 )
 
 INSURANCE_IMAP_SERVER = os.getenv("INSURANCE_IMAP_SERVER")
 INSURANCE_IMAP_PORT = int(os.getenv("INSURANCE_IMAP_PORT"))
 INSURANCE_USERNAME = os.getenv("INSURANCE_USERNAME")
 INSURANCE_PASSWORD = os.getenv("INSURANCE_PASSWORD")
+INSURANCE_MAIL_MODE = os.getenv("INSURANCE_MAIL_MODE", "poll")
+INSURANCE_CONCURRENCY = int(os.getenv("INSURANCE_CONCURRENCY", "4"))
 
 insurance_mail_settings = MailCheckSettings(
     imap_server=INSURANCE_IMAP_SERVER,
     imap_port=INSURANCE_IMAP_PORT,
     username=INSURANCE_USERNAME,
     password=INSURANCE_PASSWORD,
+    mode=INSURANCE_MAIL_MODE,
+    concurrency=INSURANCE_CONCURRENCY,
 )
 
 print(appointment_mail_settings, insurance_mail_settings)
@@ -63,3 +72,55 @@ RABBIT_URL = os.getenv("RABBIT_URL")
 REDIS_URL = os.getenv("REDIS_URL", REDIS_URL_ENV)
 TEMP_STORAGE_ROOT = Path(os.getenv("TEMP_STORAGE_ROOT", "temp"))
 EVENT_TTL_SECONDS = int(os.getenv("EVENT_TTL_SECONDS", str(15 * 60)))
+EVENT_CLEANUP_INTERVAL_SECONDS = int(os.getenv("EVENT_CLEANUP_INTERVAL_SECONDS", "60"))
+# Event keys outlive EVENT_TTL_SECONDS by this much, so the cleanup task
+# still finds their metadata (temp paths) when the event becomes due.
+EVENT_CLEANUP_GRACE_SECONDS = int(os.getenv("EVENT_CLEANUP_GRACE_SECONDS", "600"))
+# Safety-net sweep of TEMP_STORAGE_ROOT for directories and blobs that no
+# longer have a Redis key (e.g. expiry notifications missed while offline).
+EVENT_RECONCILE_INTERVAL_SECONDS = int(
+    os.getenv("EVENT_RECONCILE_INTERVAL_SECONDS", "600")
+)
+
+
+### PROCESSORS SECTION
+
+PROCESSOR_POOL_SIZE = int(os.getenv("PROCESSOR_POOL_SIZE", "2"))
+PROCESSOR_TIMEOUT_SECONDS = int(os.getenv("PROCESSOR_TIMEOUT_SECONDS", "300"))
+
+
+### OUTBOUND HTTP SECTION
+
+HTTP_TIMEOUT_SECONDS = int(os.getenv("HTTP_TIMEOUT_SECONDS", "120"))
+HTTP_CONNECT_TIMEOUT_SECONDS = int(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "10"))
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "10"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+HTTP_KEEPALIVE_SECONDS = int(os.getenv("HTTP_KEEPALIVE_SECONDS", "30"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = int(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "1"))
+
+
+### OUTBOX SECTION
+
+OUTBOX_PUBLISH_CHANNELS = int(os.getenv("OUTBOX_PUBLISH_CHANNELS", "4"))
+OUTBOX_CONFIRM_WINDOW = int(os.getenv("OUTBOX_CONFIRM_WINDOW", "64"))
+OUTBOX_MAX_IN_FLIGHT = int(os.getenv("OUTBOX_MAX_IN_FLIGHT", "16"))
+# Unacked deliveries beyond the in-flight cap only wait on a semaphore, so
+# prefetch is capped by it: at most OUTBOX_MAX_IN_FLIGHT messages are held.
+OUTBOX_PREFETCH = min(
+    int(os.getenv("OUTBOX_PREFETCH", str(OUTBOX_MAX_IN_FLIGHT))), OUTBOX_MAX_IN_FLIGHT
+)
+OUTBOX_PER_HOST_CONCURRENCY = int(os.getenv("OUTBOX_PER_HOST_CONCURRENCY", "8"))
+OUTBOX_BACKOFF_JITTER = float(os.getenv("OUTBOX_BACKOFF_JITTER", "0.5"))
+# {"crm.example.com": [10, 60, 300]} - per-destination retry delays, seconds.
+OUTBOX_BACKOFF_SCHEDULES = json.loads(os.getenv("OUTBOX_BACKOFF_SCHEDULES", "{}"))
+# Message bodies above the threshold are compressed: "zstd" (falls back to
+# gzip when the zstandard package is not installed), "gzip" or "none".
+OUTBOX_COMPRESSION = os.getenv("OUTBOX_COMPRESSION", "zstd").lower()
+OUTBOX_COMPRESSION_MIN_BYTES = int(os.getenv("OUTBOX_COMPRESSION_MIN_BYTES", "4096"))
+# Local journal that takes outbox publishes while RabbitMQ is unreachable.
+OUTBOX_SPILL_PATH = Path(os.getenv("OUTBOX_SPILL_PATH", "outbox_spill.sqlite3"))
+OUTBOX_SPILL_DRAIN_BATCH = int(os.getenv("OUTBOX_SPILL_DRAIN_BATCH", "100"))
+OUTBOX_PUBLISH_TIMEOUT_SECONDS = float(os.getenv("OUTBOX_PUBLISH_TIMEOUT_SECONDS", "5"))
@@ -1,29 +1,89 @@
 import asyncio
+import hashlib
 import json
+import os
 import shutil
+import threading
 import time
+from contextlib import suppress
 from pathlib import Path
 from typing import Any, Optional
 
 import redis.asyncio as redis
 
-from src.settings import EVENT_TTL_SECONDS, REDIS_URL, TEMP_STORAGE_ROOT
+from src.metrics import metrics
+from src.settings import (
+    EVENT_CLEANUP_GRACE_SECONDS,
+    EVENT_CLEANUP_INTERVAL_SECONDS,
+    EVENT_RECONCILE_INTERVAL_SECONDS,
+    EVENT_TTL_SECONDS,
+    REDIS_URL,
+    TEMP_STORAGE_ROOT,
+)
 
 EVENT_KEY_PREFIX = "actual_ids_mail_server"
+# ZSET event_id -> started_at of live events; expiry reads only the due range.
+EVENT_INDEX_KEY = f"{EVENT_KEY_PREFIX}_index"
+EVENT_KEY_TTL_SECONDS = EVENT_TTL_SECONDS + EVENT_CLEANUP_GRACE_SECONDS
+# Timer key per event, expiring at EVENT_TTL_SECONDS; its keyspace
+# notification triggers the cleanup while the event key still holds the paths.
+EXPIRY_KEY_PREFIX = f"{EVENT_KEY_PREFIX}_expiry"
+EXPIRED_CHANNEL_PATTERN = "__keyevent@*__:expired"
+CLEANUP_BATCH = 100
+# Event hash fields: DATA_FIELD holds the JSON written by `start_event`,
+# each stored attachment adds "file:<name>" (its path in the event directory).
+DATA_FIELD = "data"
+FILE_FIELD_PREFIX = "file:"
+# LIST per event with the digests of the blob references it holds. No TTL:
+# it must outlive the event hash, or references of events whose hash expired
+# (service down past the grace period) would never be released.
+EVENT_BLOBS_KEY_PREFIX = f"{EVENT_KEY_PREFIX}_refs"
+BLOB_KEY_PREFIX = f"{EVENT_KEY_PREFIX}_blob"
+BLOB_DIR_NAME = "_blobs"
+# DECR and drop the counter at zero atomically, so a reference taken in
+# between is not deleted along with it. The file itself is renamed away and
+# the counter checked again before the unlink (see `release_blob`).
+RELEASE_BLOB_SCRIPT = """
+local remaining = redis.call('DECR', KEYS[1])
+if remaining <= 0 then redis.call('DEL', KEYS[1]) end
+return remaining
+"""
 
 
 def _sanitize_segment(value: str) -> str:
     return "".join(ch if ch.isalnum() or ch in ("-", "_") else "_" for ch in value)
 
 
+def _decode_event(fields: dict[str, str]) -> Optional[dict[str, Any]]:
+    if DATA_FIELD not in fields:
+        return None
+    meta = json.loads(fields[DATA_FIELD])
+    meta["files"] = [
+        value
+        for name, value in sorted(fields.items())
+        if name.startswith(FILE_FIELD_PREFIX)
+    ]
+    return meta
+
+
 class EventRegistry:
     def __init__(self) -> None:
         self._redis = redis.from_url(REDIS_URL, decode_responses=True)
+        self._release_blob_script = self._redis.register_script(RELEASE_BLOB_SCRIPT)
         self._base_dir = TEMP_STORAGE_ROOT
         self._base_dir.mkdir(parents=True, exist_ok=True)
 
-    def _key(self, rule_name: str) -> str:
-        return f"{EVENT_KEY_PREFIX}:{rule_name}"
+    def _key(self, event_id: str) -> str:
+        return f"{EVENT_KEY_PREFIX}:{event_id}"
+
+    def _expiry_key(self, event_id: str) -> str:
+        return f"{EXPIRY_KEY_PREFIX}:{event_id}"
+
+    def _blobs_key(self, event_id: str) -> str:
+        return f"{EVENT_BLOBS_KEY_PREFIX}:{event_id}"
+
+    def _blob_path(self, digest: str) -> Path:
+        return self._base_dir / BLOB_DIR_NAME / digest[:2] / digest[2:4] / digest
 
     def _rule_dir(self, rule_name: str) -> Path:
         safe_rule = _sanitize_segment(rule_name)
@@ -36,7 +96,6 @@ class EventRegistry:
         permanent_file: bool = False,
         metadata: Optional[dict[str, Any]] = None,
     ) -> dict[str, Any]:
-        await self.cleanup_expired()
         rule_dir = self._rule_dir(rule_name)
         event_dir = rule_dir / _sanitize_segment(event_id)
         event_dir.mkdir(parents=True, exist_ok=True)
@@ -47,92 +106,344 @@ class EventRegistry:
             "started_at": int(time.time()),
             "permanent_file": bool(permanent_file),
             "path": str(event_dir),
-            "files": [],
         }
         if metadata:
             payload.update(metadata)
 
-        await self._redis.set(self._key(rule_name), json.dumps(payload))
-        await self._redis.expire(self._key(rule_name), EVENT_TTL_SECONDS)
+        # One round-trip, applied atomically.
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(event_id), DATA_FIELD, json.dumps(payload))
+            pipe.expire(self._key(event_id), EVENT_KEY_TTL_SECONDS)
+            pipe.zadd(EVENT_INDEX_KEY, {event_id: payload["started_at"]})
+            pipe.set(self._expiry_key(event_id), 1, ex=EVENT_TTL_SECONDS)
+            await pipe.execute()
+        payload["files"] = []
         return payload
 
-    async def get_event(self, rule_name: str) -> Optional[dict[str, Any]]:
-        raw = await self._redis.get(self._key(rule_name))
-        if not raw:
-            return None
-        return json.loads(raw)
+    async def get_event(self, event_id: str) -> Optional[dict[str, Any]]:
+        try:
+            fields = await self._redis.hgetall(self._key(event_id))
+        except redis.ResponseError:
+            # Pre-hash layout: the whole event as one JSON string.
+            raw = await self._redis.get(self._key(event_id))
+            return json.loads(raw) if raw else None
+        return _decode_event(fields)
 
     async def store_attachments(
         self,
-        rule_name: str,
         event_id: str,
         attachments: list[tuple[str, bytes]],
     ) -> list[str]:
         if not attachments:
             return []
-        meta = await self.get_event(rule_name)
-        if not meta or meta.get("event_id") != event_id:
+        raw = await self._redis.hget(self._key(event_id), DATA_FIELD)
+        if not raw:
             return []
 
-        event_dir = Path(meta["path"])
-
-        def _write_files() -> list[str]:
-            saved_paths: list[str] = []
-            for filename, payload in attachments:
-                safe_name = _sanitize_segment(filename) or "attachment"
-                target = event_dir / safe_name
-                with open(target, "wb") as fh:
-                    fh.write(payload)
-                saved_paths.append(str(target))
-            return saved_paths
-
-        saved = await asyncio.to_thread(_write_files)
-        meta.setdefault("files", [])
-        meta["files"].extend(saved)
-        await self._redis.set(self._key(rule_name), json.dumps(meta))
-        await self._redis.expire(self._key(rule_name), EVENT_TTL_SECONDS)
-        return saved
-
-    async def finish_event(
-        self, rule_name: str, event_id: str, permanent_file: bool = False
-    ) -> None:
-        meta = await self.get_event(rule_name)
-        if not meta or meta.get("event_id") != event_id:
+        event_dir = Path(json.loads(raw)["path"])
+
+        names: list[str] = []
+        for filename, _payload in attachments:
+            safe_name = _sanitize_segment(filename) or "attachment"
+            candidate, index = safe_name, 1
+            while candidate in names:
+                index += 1
+                candidate = f"{safe_name}-{index}"
+            names.append(candidate)
+
+        digests = await asyncio.to_thread(
+            lambda: [hashlib.sha256(payload).hexdigest() for _, payload in attachments]
+        )
+        # References are taken before the files are linked, so a concurrent
+        # release of the same blob cannot delete it underneath us; the event
+        # records them in the same transaction.
+        async with self._redis.pipeline(transaction=True) as pipe:
+            for digest in digests:
+                pipe.incr(f"{BLOB_KEY_PREFIX}:{digest}")
+            pipe.rpush(self._blobs_key(event_id), *digests)
+            await pipe.execute()
+
+        def _link_files() -> tuple[dict[str, str], int]:
+            fields: dict[str, str] = {}
+            reused_bytes = 0
+            for name, digest, (_filename, payload) in zip(names, digests, attachments):
+                target = event_dir / name
+                if self._link_blob(digest, payload, target):
+                    reused_bytes += len(payload)
+                fields[f"{FILE_FIELD_PREFIX}{name}"] = str(target)
+            return fields, reused_bytes
+
+        fields, reused_bytes = await asyncio.to_thread(_link_files)
+        metrics.inc("storage.attachment_bytes", sum(len(p) for _, p in attachments))
+        metrics.inc("storage.attachment_bytes_deduplicated", reused_bytes)
+        # New fields only: no read-modify-write of the event, so concurrent
+        # writers cannot lose each other's files.
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(event_id), mapping=fields)
+            pipe.expire(self._key(event_id), EVENT_KEY_TTL_SECONDS)
+            await pipe.execute()
+        return [fields[f"{FILE_FIELD_PREFIX}{name}"] for name in names]
+
+    async def finish_event(self, event_id: str, permanent_file: bool = False) -> None:
+        meta = await self.get_event(event_id)
+        if not meta:
             return
         if permanent_file:
-            await self._redis.expire(self._key(rule_name), EVENT_TTL_SECONDS)
+            # Files stay until the event is due; the expiry worker removes them.
+            await self._redis.expire(self._key(event_id), EVENT_KEY_TTL_SECONDS)
             return
-        await self._cleanup_event(rule_name, meta)
-
-    async def cleanup_expired(self) -> None:
-        keys = await self._redis.keys(f"{EVENT_KEY_PREFIX}:*")
-        now = int(time.time())
-        for key in keys:
-            raw = await self._redis.get(key)
-            if not raw:
-                continue
-            meta = json.loads(raw)
-            started = meta.get("started_at")
-            if started is None:
+        await self._cleanup_event(event_id, meta)
+
+    async def cleanup_expired(self) -> int:
+        """
+        Removes events started more than EVENT_TTL_SECONDS ago.
+        Reads only the due range of the index, so the cost does not depend on
+        the Redis keyspace size. Returns the number of events removed.
+        """
+        cutoff = int(time.time()) - EVENT_TTL_SECONDS
+        removed = 0
+        while True:
+            due = await self._redis.zrangebyscore(
+                EVENT_INDEX_KEY, "-inf", cutoff, start=0, num=CLEANUP_BATCH
+            )
+            if not due:
+                break
+            for event_id in due:
+                meta = await self.get_event(event_id) or {}
+                await self._cleanup_event(event_id, meta)
+                removed += 1
+        if removed:
+            metrics.inc("events.expired", removed)
+        return removed
+
+    async def _index_unindexed_events(self) -> None:
+        """Adds events written before the index existed (SCAN, not KEYS)."""
+        async for key in self._redis.scan_iter(match=f"{EVENT_KEY_PREFIX}:*"):
+            # Older keys are per rule (`prefix:<rule_name>`); indexing the key
+            # suffix lets `cleanup_expired` find either layout through `_key`.
+            member = key.removeprefix(f"{EVENT_KEY_PREFIX}:")
+            meta = await self.get_event(member)
+            if not meta:
                 continue
-            if now - int(started) >= EVENT_TTL_SECONDS:
-                rule_name = meta.get("rule_name") or key.removeprefix(
-                    f"{EVENT_KEY_PREFIX}:"
-                )
-                await self._cleanup_event(rule_name, meta)
-
-    async def _cleanup_event(self, rule_name: str, meta: dict[str, Any]) -> None:
-        await self._redis.delete(self._key(rule_name))
-        path_str = meta.get("path")
-        if not path_str:
-            return
-        event_dir = Path(path_str)
+            started = int(meta.get("started_at") or time.time())
+            await self._redis.zadd(EVENT_INDEX_KEY, {member: started}, nx=True)
+
+    async def cleanup_loop(
+        self,
+        interval: int = EVENT_CLEANUP_INTERVAL_SECONDS,
+        reconcile_interval: int = EVENT_RECONCILE_INTERVAL_SECONDS,
+    ) -> None:
+        """
+        Periodic expiry of events, off the mail-processing path.
+        Backs up `listen_expirations`: Redis does not redeliver notifications
+        missed while we were disconnected.
+        """
+        await self._index_unindexed_events()
+        last_reconcile = 0.0
+        while True:
+            await self.cleanup_expired()
+            if time.monotonic() - last_reconcile >= reconcile_interval:
+                await self.reconcile_storage()
+                last_reconcile = time.monotonic()
+            await asyncio.sleep(interval)
+
+    async def _enable_expiry_notifications(self) -> None:
+        try:
+            config = await self._redis.config_get("notify-keyspace-events")
+            flags = config.get("notify-keyspace-events", "")
+            if "E" in flags and ("x" in flags or "A" in flags):
+                return
+            await self._redis.config_set(
+                "notify-keyspace-events", "".join(sorted(set(flags) | {"E", "x"}))
+            )
+        except redis.ResponseError as e:
+            # Managed Redis often forbids CONFIG; then the periodic sweep
+            # (or notify-keyspace-events Ex set by the admin) has to do.
+            print(f"[EVENTS] Не удалось включить уведомления об истечении ключей: {e}")
+
+    async def expire_event(self, event_id: str) -> None:
+        meta = await self.get_event(event_id)
+        if meta is not None:
+            await self._cleanup_event(event_id, meta)
+            metrics.inc("events.expired_notified")
+
+    async def listen_expirations(self) -> None:
+        """
+        Cleans events up as soon as their timer key expires, driven by Redis
+        keyspace notifications (`__keyevent@*__:expired`).
+        """
+        await self._enable_expiry_notifications()
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.psubscribe(EXPIRED_CHANNEL_PATTERN)
+        prefix = f"{EXPIRY_KEY_PREFIX}:"
+        try:
+            async for message in pubsub.listen():
+                key = message.get("data")
+                if isinstance(key, str) and key.startswith(prefix):
+                    await self.expire_event(key.removeprefix(prefix))
+        finally:
+            await pubsub.aclose()
+
+    async def reconcile_storage(self) -> int:
+        """
+        Removes event directories and blob files that are older than the
+        event key TTL and have no Redis key any more. Returns the count removed.
+        """
+        cutoff = time.time() - EVENT_KEY_TTL_SECONDS
+        base_dir = self._base_dir
+
+        def _stale_paths() -> tuple[list[Path], list[Path], list[Path]]:
+            event_dirs: list[Path] = []
+            blobs: list[Path] = []
+            tmp_files: list[Path] = []
+            for rule_dir in base_dir.iterdir():
+                if not rule_dir.is_dir() or rule_dir.name == BLOB_DIR_NAME:
+                    continue
+                for event_dir in rule_dir.iterdir():
+                    with suppress(FileNotFoundError):
+                        if event_dir.is_dir() and event_dir.stat().st_mtime < cutoff:
+                            event_dirs.append(event_dir)
+            for path in (base_dir / BLOB_DIR_NAME).glob("*/*/*"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime >= cutoff:
+                    continue
+                if path.name.endswith(".tmp"):
+                    tmp_files.append(path)
+                # Still hardlinked from an event directory: not an orphan.
+                elif stat.st_nlink == 1:
+                    blobs.append(path)
+            return event_dirs, blobs, tmp_files
+
+        event_dirs, blobs, tmp_files = await asyncio.to_thread(_stale_paths)
+        if not event_dirs and not blobs and not tmp_files:
+            return 0
+
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for event_dir in event_dirs:
+                pipe.exists(self._key(event_dir.name))
+            for blob in blobs:
+                pipe.exists(f"{BLOB_KEY_PREFIX}:{blob.name}")
+            exists = await pipe.execute()
+        orphans = [
+            path for path, alive in zip([*event_dirs, *blobs], exists) if not alive
+        ] + tmp_files
 
         def _remove() -> None:
-            if event_dir.exists():
-                shutil.rmtree(event_dir, ignore_errors=True)
+            for path in orphans:
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink(missing_ok=True)
 
         await asyncio.to_thread(_remove)
+        if orphans:
+            metrics.inc("storage.orphans_removed", len(orphans))
+            print(f"[EVENTS] Удалено потерянных временных файлов/папок: {len(orphans)}")
+        return len(orphans)
+
+    async def store_blob(self, data: bytes) -> str:
+        """
+        Stores `data` content-addressed (sha256) and takes a reference on it.
+        Identical payloads share one file. Returns the digest.
+        """
+        digest = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+        await self._redis.incr(f"{BLOB_KEY_PREFIX}:{digest}")
+        await asyncio.to_thread(self._write_blob, digest, data)
+        return digest
+
+    def _write_blob(self, digest: str, data: bytes) -> bool:
+        """Writes the blob file unless present. Returns True if it was present."""
+        target = self._blob_path(digest)
+        if target.exists():
+            return True
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        # Read-only: event directories hold hardlinks to the same inode.
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, target)
+        return False
+
+    def _link_blob(self, digest: str, data: bytes, target: Path) -> bool:
+        """
+        Hardlinks blob `digest` to `target`, writing the blob first if needed.
+        Falls back to a copy where hardlinks are not supported.
+        Returns True if the blob already existed (no data written).
+        """
+        target.unlink(missing_ok=True)
+        reused = self._write_blob(digest, data)
+        try:
+            os.link(self._blob_path(digest), target)
+        except FileNotFoundError:
+            # Last reference released between the check and the link.
+            reused = self._write_blob(digest, data)
+            os.link(self._blob_path(digest), target)
+        except OSError:
+            shutil.copyfile(self._blob_path(digest), target)
+        return reused
+
+    async def load_blob(self, digest: str) -> bytes:
+        return await asyncio.to_thread(self._blob_path(digest).read_bytes)
+
+    async def release_blob(self, digest: str) -> None:
+        """Drops one reference; the file is removed with the last one."""
+        remaining = await self._release_blob_script(
+            keys=[f"{BLOB_KEY_PREFIX}:{digest}"]
+        )
+        if remaining > 0:
+            return
+        path = self._blob_path(digest)
+        tombstone = await asyncio.to_thread(self._bury_blob, path)
+        if tombstone is None:
+            return
+        # A store_blob that took a reference before the rename may have seen
+        # the file and skipped writing it: put the file back for it.
+        if await self._redis.exists(f"{BLOB_KEY_PREFIX}:{digest}"):
+            await asyncio.to_thread(os.replace, tombstone, path)
+        else:
+            await asyncio.to_thread(lambda: tombstone.unlink(missing_ok=True))
+
+    def _bury_blob(self, path: Path) -> Optional[Path]:
+        """
+        Renames a released blob out of the way before it is deleted, so a
+        concurrent `_write_blob` writes a fresh file instead of relying on it.
+        Returns the new path, or None if the file is already gone.
+        """
+        tombstone = path.with_name(
+            f"{path.name}.{os.getpid()}.{threading.get_ident()}.released.tmp"
+        )
+        try:
+            os.rename(path, tombstone)
+        except FileNotFoundError:
+            return None
+        return tombstone
+
+    async def _cleanup_event(self, event_id: str, meta: dict[str, Any]) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._key(event_id))
+            pipe.delete(self._expiry_key(event_id))
+            pipe.zrem(EVENT_INDEX_KEY, event_id)
+            pipe.lrange(self._blobs_key(event_id), 0, -1)
+            pipe.delete(self._blobs_key(event_id))
+            *_, digests, taken = await pipe.execute()
+        path_str = meta.get("path")
+        if path_str:
+            event_dir = Path(path_str)
+
+            def _remove() -> None:
+                if event_dir.exists():
+                    shutil.rmtree(event_dir, ignore_errors=True)
+
+            await asyncio.to_thread(_remove)
+        # Only whoever deleted the references list drops them, so a concurrent
+        # finish/expiry of the same event cannot release them twice.
+        if taken:
+            for digest in digests:
+                await self.release_blob(digest)
 
 
 event_registry = EventRegistry()
@@ -0,0 +1,47 @@
+import json
+from typing import Any, Optional
+
+import redis.asyncio as redis
+
+from src.settings import REDIS_URL
+from src.storage.event_registry import EVENT_KEY_PREFIX
+
+CHECKPOINT_KEY_PREFIX = f"{EVENT_KEY_PREFIX}_checkpoint"
+
+
+class MailCheckpointStore:
+    """
+    Per-mailbox IMAP sync state: (UIDVALIDITY, last_uid) high-water mark plus
+    UIDs below it that still have to be retried.
+    """
+
+    def __init__(self) -> None:
+        self._redis = redis.from_url(REDIS_URL, decode_responses=True)
+
+    def _key(self, mailbox: str) -> str:
+        return f"{CHECKPOINT_KEY_PREFIX}:{mailbox}"
+
+    async def load(self, mailbox: str) -> Optional[dict[str, Any]]:
+        raw = await self._redis.get(self._key(mailbox))
+        if not raw:
+            return None
+        return json.loads(raw)
+
+    async def save(
+        self,
+        mailbox: str,
+        uidvalidity: int,
+        last_uid: int,
+        retry_uids: list[int],
+    ) -> None:
+        payload = {
+            "uidvalidity": uidvalidity,
+            "last_uid": last_uid,
+            "retry_uids": sorted(set(retry_uids)),
+        }
+        await self._redis.set(self._key(mailbox), json.dumps(payload))
+
+
+mail_checkpoints = MailCheckpointStore()
+
+__all__ = ["mail_checkpoints"]